@@ -1,6 +1,7 @@
 import numpy as np
-import qpoases
-import IPython
+from mm2d.util import LazyModule
+
+qpoases = LazyModule('qpoases')
 
 
 NUM_WSR = 100    # number of working set recalculations
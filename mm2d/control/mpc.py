@@ -1,8 +1,8 @@
 import numpy as np
-from scipy import sparse
 from mm2d import util
-import qpoases
-import IPython
+
+qpoases = util.LazyModule('qpoases')
+sparse = util.LazyModule('scipy.sparse')
 
 
 # mpc parameters
@@ -10,19 +10,92 @@ NUM_WSR = 100    # number of working set recalculations
 NUM_ITER = 3     # number of linearizations/iterations
 
 
+class MPCWorkspace:
+    ''' Work arrays of MPC for one horizon length N, allocated once so that
+        steady-state solves write into them rather than allocating new
+        arrays. '''
+    def __init__(self, ni, no, N, dt, Q, R, vel_lim, acc_lim):
+        self.N = N
+
+        # constant matrices of the lifted problem
+        self.Qbar = np.kron(np.eye(N), Q)
+        self.Rbar = np.kron(np.eye(N), R)
+        self.Ebar = np.kron(np.tril(np.ones((N, N))), np.eye(ni))
+        A0 = sparse.diags((np.ones(N), -np.ones(N - 1)), [0, -1]).toarray()
+        self.A = np.kron(A0, np.eye(ni))
+        self.L_vel = vel_lim * np.ones(ni * N)
+        self.L_acc = dt * acc_lim * np.ones(ni * N)
+
+        # lookahead
+        self.qbar = np.zeros(ni * (N + 1))
+        self.Eu = np.zeros(ni * N)
+        self.fbar = np.zeros(no * N)
+        self.Jbar = np.zeros((no * N, ni * N))
+        self.dbar = np.zeros(no * N)
+        self.QJ = np.zeros((no * N, ni * N))
+        self.JQJ = np.zeros((ni * N, ni * N))
+        self.JQJE = np.zeros((ni * N, ni * N))
+        self.dQJ = np.zeros(ni * N)
+        self.gq = np.zeros(ni * N)
+        self.H = np.zeros((ni * N, ni * N))
+        self.g = np.zeros(ni * N)
+
+        # constraints
+        self.lb = np.zeros(ni * N)
+        self.ub = np.zeros(ni * N)
+        self.u_prev = np.zeros(ni * N)
+        self.du = np.zeros(ni * N)
+        self.lbA = np.zeros(ni * N)
+        self.ubA = np.zeros(ni * N)
+
+        # iterates
+        self.u = np.zeros(ni * N)
+        self.delta = np.zeros(ni * N)
+        self.qp = None
+
+
 class MPC(object):
-    ''' Model predictive controller. '''
-    def __init__(self, model, dt, Q, R, vel_lim, acc_lim):
+    ''' Model predictive controller.
+
+        By default each iteration uses the Gauss-Newton approximation of the
+        tracking cost's Hessian. If exact_hessian is True, the second-order
+        kinematics from model.hessian are added, which typically needs fewer
+        iterations (num_iter) to converge; note that the exact Hessian can be
+        indefinite far from the reference.
+
+        If preallocate is True, all work arrays (and the QP itself) are
+        allocated once per horizon length and reused by later solves, which
+        then only write into existing buffers. This requires the model's
+        forward and jacobian to accept an out argument. '''
+    def __init__(self, model, dt, Q, R, vel_lim, acc_lim, exact_hessian=False,
+                 num_iter=NUM_ITER, preallocate=False):
         self.model = model
         self.dt = dt
         self.Q = Q
         self.R = R
         self.vel_lim = vel_lim
         self.acc_lim = acc_lim
+        self.exact_hessian = exact_hessian
+        self.num_iter = num_iter
+        self.preallocate = preallocate
+        self._workspaces = {}
+
+    def _workspace(self, N):
+        ''' Work arrays for horizon length N, created on first use. '''
+        try:
+            return self._workspaces[N]
+        except KeyError:
+            ws = MPCWorkspace(self.model.ni, self.model.no, N, self.dt, self.Q,
+                              self.R, self.vel_lim, self.acc_lim)
+            self._workspaces[N] = ws
+            return ws
 
     def _lookahead(self, q0, pr, u, N):
         ''' Generate lifted matrices proprogating the state N timesteps into the
             future. '''
+        if self.preallocate:
+            return self._lookahead_inplace(q0, pr, u, N)
+
         ni = self.model.ni  # number of joints
         no = self.model.no  # number of Cartesian outputs
 
@@ -47,18 +120,94 @@ class MPC(object):
             Jbar[k*no:(k+1)*no, k*ni:(k+1)*ni] = J
 
         dbar = fbar - pr
-        H = Rbar + self.dt**2*Ebar.T.dot(Jbar.T).dot(Qbar).dot(Jbar).dot(Ebar)
+        JQJ = Jbar.T.dot(Qbar).dot(Jbar)
+
+        # second-order term of the tracking cost: sum_i (Q*d)_i * Hess(p_i)
+        if self.exact_hessian:
+            Qd = Qbar.dot(dbar).reshape((N, no))
+            Hs = self.model.hessian(qbar[ni:].reshape((N, ni)))
+            for k in range(N):
+                JQJ[k*ni:(k+1)*ni, k*ni:(k+1)*ni] += np.tensordot(Qd[k], Hs[k], axes=1)
+
+        H = Rbar + self.dt**2*Ebar.T.dot(JQJ).dot(Ebar)
         g = u.T.dot(Rbar) + self.dt*dbar.T.dot(Qbar).dot(Jbar).dot(Ebar)
 
         return H, g
 
-    def _calc_vel_limits(self, u, ni, N):
-        L = np.ones(ni * N) * self.vel_lim
-        lb = -L - u
-        ub = L - u
+    def _lookahead_inplace(self, q0, pr, u, N):
+        ''' Same as _lookahead, but computed in the work arrays for horizon N,
+            which hold the returned H and g until the next call. '''
+        ni = self.model.ni
+        no = self.model.no
+        ws = self._workspace(N)
+
+        # qbar = [q0, q0 + dt * E @ u]
+        ws.qbar.reshape((N + 1, ni))[:] = q0
+        np.dot(ws.Ebar, u, out=ws.Eu)
+        ws.Eu *= self.dt
+        ws.qbar[ni:] += ws.Eu
+
+        for k in range(N):
+            q = ws.qbar[(k+1)*ni:(k+2)*ni]
+            self.model.forward(q, out=ws.fbar[k*no:(k+1)*no])
+            self.model.jacobian(q, out=ws.Jbar[k*no:(k+1)*no, k*ni:(k+1)*ni])
+
+        np.subtract(ws.fbar, pr, out=ws.dbar)
+        np.dot(ws.Qbar, ws.Jbar, out=ws.QJ)
+        np.dot(ws.Jbar.T, ws.QJ, out=ws.JQJ)
+
+        if self.exact_hessian:
+            Qd = ws.Qbar.dot(ws.dbar).reshape((N, no))
+            Hs = self.model.hessian(ws.qbar[ni:].reshape((N, ni)))
+            for k in range(N):
+                ws.JQJ[k*ni:(k+1)*ni, k*ni:(k+1)*ni] += np.tensordot(Qd[k], Hs[k], axes=1)
+
+        # H = R + dt^2 * E^T @ JQJ @ E
+        np.dot(ws.JQJ, ws.Ebar, out=ws.JQJE)
+        np.dot(ws.Ebar.T, ws.JQJE, out=ws.H)
+        ws.H *= self.dt**2
+        ws.H += ws.Rbar
+
+        # g = R @ u + dt * E^T @ J^T @ Q @ d
+        np.dot(u, ws.Rbar, out=ws.g)
+        np.dot(ws.dbar, ws.QJ, out=ws.dQJ)
+        np.dot(ws.dQJ, ws.Ebar, out=ws.gq)
+        ws.gq *= self.dt
+        ws.g += ws.gq
+
+        return ws.H, ws.g
+
+    def _calc_vel_limits(self, u, ni, N, out=None):
+        ''' Bounds on the change in the inputs u from the velocity limits. If
+            out = (lb, ub) is given, the bounds are written into it. '''
+        if out is None:
+            L = np.ones(ni * N) * self.vel_lim
+            lb = -L - u
+            ub = L - u
+            return lb, ub
+
+        lb, ub = out
+        L = self._workspace(N).L_vel
+        np.add(L, u, out=lb)
+        np.negative(lb, out=lb)
+        np.subtract(L, u, out=ub)
         return lb, ub
 
-    def _calc_acc_limits(self, u, dq0, ni, N):
+    def _calc_acc_limits(self, u, dq0, ni, N, out=None):
+        ''' Constraints on the change in the inputs u from the acceleration
+            limits. If out = (A, lbA, ubA) is given, the bounds are written
+            into lbA and ubA; A depends only on N and is assumed to already
+            hold the constraint matrix. '''
+        if out is not None:
+            A, lbA, ubA = out
+            ws = self._workspace(N)
+            ws.u_prev[:ni] = dq0
+            ws.u_prev[ni:] = u[:-ni]
+            np.subtract(ws.u_prev, u, out=ws.du)
+            np.subtract(ws.du, ws.L_acc, out=lbA)
+            np.add(ws.du, ws.L_acc, out=ubA)
+            return A, lbA, ubA
+
         # u_prev consists of [dq0, u_0, u_1, ..., u_{N-2}]
         # u is [u_0, ..., u_{N-1}]
         u_prev = np.zeros(ni * N)
@@ -81,6 +230,9 @@ class MPC(object):
         return A, lbA, ubA
 
     def _iterate(self, q0, dq0, pr, u, N):
+        if self.preallocate:
+            return self._iterate_inplace(q0, dq0, pr, u, N)
+
         ni = self.model.ni
 
         # Create the QP, which we'll solve sequentially.
@@ -105,7 +257,7 @@ class MPC(object):
         u = u + delta
 
         # Remaining sequence is hotstarted from the first.
-        for i in range(NUM_ITER - 1):
+        for i in range(self.num_iter - 1):
             H, g = self._lookahead(q0, pr, u, N)
             lb, ub = self._calc_vel_limits(u, ni, N)
             A, lbA, ubA = self._calc_acc_limits(u, dq0, ni, N)
@@ -117,17 +269,77 @@ class MPC(object):
 
         return u
 
-    def solve(self, q0, dq0, pr, N):
+    def _iterate_inplace(self, q0, dq0, pr, u, N):
+        ''' Same as _iterate, but using the work arrays for horizon N. u is
+            updated in place. '''
+        ni = self.model.ni
+        ws = self._workspace(N)
+
+        # the QP is created once and re-initialized by each solve
+        if ws.qp is None:
+            ws.qp = qpoases.PySQProblem(ni * N, ni * N)
+            options = qpoases.PyOptions()
+            options.printLevel = qpoases.PyPrintLevel.NONE
+            ws.qp.setOptions(options)
+            ws.nWSR = np.array([NUM_WSR])
+
+        for i in range(self.num_iter):
+            H, g = self._lookahead(q0, pr, u, N)
+            self._calc_vel_limits(u, ni, N, out=(ws.lb, ws.ub))
+            self._calc_acc_limits(u, dq0, ni, N, out=(ws.A, ws.lbA, ws.ubA))
+
+            # qpOASES overwrites the working set limit with the number used
+            ws.nWSR[0] = NUM_WSR
+            if i == 0:
+                ws.qp.init(H, g, ws.A, ws.lb, ws.ub, ws.lbA, ws.ubA, ws.nWSR)
+            else:
+                ws.qp.hotstart(H, g, ws.A, ws.lb, ws.ub, ws.lbA, ws.ubA, ws.nWSR)
+            ws.qp.getPrimalSolution(ws.delta)
+            u += ws.delta
+
+        return u
+
+    def ik_seed(self, q0, pr, N):
+        ''' Initial guess of the inputs that moves the joints through the
+            inverse kinematics solutions of the desired output trajectory,
+            subject to the velocity limits. The redundancy of each solution is
+            resolved toward the previous one, starting from q0. '''
+        ni = self.model.ni
+        no = self.model.no
+        pr = pr.reshape((N, no))
+
+        qs = np.zeros((N + 1, ni))
+        qs[0] = q0
+        for k in range(N):
+            qs[k+1], _ = self.model.inverse_kinematics(pr[k], q_nominal=qs[k])
+
+        u = util.bound_array(np.diff(qs, axis=0) / self.dt, -self.vel_lim,
+                             self.vel_lim)
+        return u.flatten()
+
+    def solve(self, q0, dq0, pr, N, u0=None):
         ''' Solve the MPC problem at current state x0 given desired output
-            trajectory Yd. '''
+            trajectory Yd. u0 is an optional initial guess of the optimal
+            inputs, such as the previous solution or one from ik_seed;
+            otherwise the inputs are initialized to zero. '''
         # initialize optimal inputs
-        u = np.zeros(self.model.ni * N)
+        if self.preallocate:
+            u = self._workspace(N).u
+            if u0 is None:
+                u.fill(0)
+            else:
+                u[:] = u0
+        elif u0 is None:
+            u = np.zeros(self.model.ni * N)
+        else:
+            u = np.array(u0, dtype=np.float64)
 
         # iterate to final solution
         u = self._iterate(q0, dq0, pr, u, N)
 
-        # return first optimal input
-        return u[:self.model.ni]
+        # return first optimal input (copied, since in preallocated mode u is
+        # reused by the next solve)
+        return u[:self.model.ni].copy()
 
 
 class ObstacleAvoidingMPC(object):
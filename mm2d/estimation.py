@@ -0,0 +1,58 @@
+# Estimation of model parameters that enter linearly, i.e. y = Y @ θ, such as
+# the inertial parameters of ThreeInputModel via its dynamics regressor.
+import numpy as np
+
+
+def least_squares(Y, y, weights=None):
+    ''' Batch least-squares estimate of the parameters θ from a stack of
+        samples y = Y @ θ, where Y has shape (..., m, p) and y has shape
+        (..., m). All samples are stacked into a single problem, which is
+        solved in one call. Optional weights with the shape of y scale the
+        residual of each equation. Returns θ with shape (p,). '''
+    Y = np.asarray(Y, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    p = Y.shape[-1]
+
+    A = Y.reshape((-1, p))
+    b = y.reshape(-1)
+    if weights is not None:
+        w = np.sqrt(np.broadcast_to(weights, y.shape).reshape(-1))
+        A = w[:, None] * A
+        b = w * b
+
+    θ, _, _, _ = np.linalg.lstsq(A, b, rcond=None)
+    return θ
+
+
+class RecursiveLeastSquares:
+    ''' Streaming least-squares estimator of parameters θ of the model
+        y = Y @ θ, which is updated one sample (or small batch of samples) at a
+        time with constant cost.
+
+        θ0 is the initial estimate and P0 its covariance (a scalar is taken as
+        a multiple of the identity); a large P0 expresses low confidence in
+        θ0. A forgetting factor less than one discounts old samples so that
+        the estimate can track slowly-varying parameters. '''
+    def __init__(self, θ0, P0=1e3, forgetting=1.0):
+        self.θ = np.array(θ0, dtype=np.float64)
+        p = self.θ.shape[0]
+        self.P = P0 * np.eye(p) if np.isscalar(P0) else np.array(P0, dtype=np.float64)
+        self.forgetting = forgetting
+
+    def update(self, Y, y):
+        ''' Update the estimate with the samples y = Y @ θ, where Y has shape
+            (m, p) or (..., m, p) and y has the corresponding shape. Returns
+            the new estimate. '''
+        Y = np.asarray(Y, dtype=np.float64).reshape((-1, self.θ.shape[0]))
+        y = np.asarray(y, dtype=np.float64).reshape(-1)
+        λ = self.forgetting
+
+        # Information form of the update, P⁺ = (λP⁻¹ + YᵀY)⁻¹, which only
+        # needs p×p inverses however many samples are in the update. It is
+        # equivalent to the usual gain form P⁺ = (P - K Y P) / λ.
+        P = np.linalg.inv(λ * np.linalg.inv(self.P) + Y.T @ Y)
+        self.θ = self.θ + P @ Y.T @ (y - Y @ self.θ)
+
+        # keep the covariance symmetric in the face of round-off
+        self.P = 0.5 * (P + P.T)
+        return self.θ
@@ -0,0 +1,169 @@
+# Manipulability and singularity metrics of the EE Jacobian, computed in closed
+# form for whole stacks of Jacobians, and maps of these metrics over the arm's
+# joint space that are cached to disk and can be looked up by controllers and
+# planners.
+import hashlib
+import os
+
+import numpy as np
+
+
+# default location of cached maps
+MAP_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'mm2d', 'maps')
+
+# default number of grid points per arm joint, covering [-π, π)
+MAP_RESOLUTION = 256
+
+METRICS = ('manipulability', 'condition_number', 'singular_values')
+
+
+def singular_values(J):
+    ''' Singular values of a stack of 2×n or 3×n Jacobians with shape
+        (..., m, n), computed in closed form from the eigenvalues of J @ J.T.
+        Returns shape (..., m), in descending order. '''
+    J = np.asarray(J)
+    A = J @ np.swapaxes(J, -1, -2)
+    m = A.shape[-1]
+
+    if m == 2:
+        mean = 0.5 * (A[..., 0, 0] + A[..., 1, 1])
+        d = np.sqrt((0.5 * (A[..., 0, 0] - A[..., 1, 1]))**2 + A[..., 0, 1]**2)
+        eigs = np.stack((mean + d, mean - d), axis=-1)
+    elif m == 3:
+        # trigonometric solution of the characteristic cubic of a symmetric
+        # matrix
+        q = np.trace(A, axis1=-2, axis2=-1) / 3
+        p1 = A[..., 0, 1]**2 + A[..., 0, 2]**2 + A[..., 1, 2]**2
+        p2 = (A[..., 0, 0] - q)**2 + (A[..., 1, 1] - q)**2 \
+                + (A[..., 2, 2] - q)**2 + 2 * p1
+        p = np.sqrt(p2 / 6)
+
+        # if p = 0 all eigenvalues equal q, whatever the value of φ
+        p_safe = np.where(p > 0, p, 1)
+        B = (A - q[..., None, None] * np.eye(3)) / p_safe[..., None, None]
+        r = np.linalg.det(B) / 2
+        φ = np.arccos(np.clip(r, -1, 1)) / 3
+
+        e1 = q + 2 * p * np.cos(φ)
+        e3 = q + 2 * p * np.cos(φ + 2 * np.pi / 3)
+        e2 = 3 * q - e1 - e3
+        eigs = np.stack((e1, e2, e3), axis=-1)
+    else:
+        raise ValueError('Closed-form singular values require 2 or 3 rows, '
+                         'not {}.'.format(m))
+
+    return np.sqrt(np.maximum(eigs, 0))
+
+
+def manipulability(J):
+    ''' Yoshikawa's manipulability measure sqrt(det(J @ J.T)) of a stack of
+        Jacobians with shape (..., m, n). '''
+    return np.prod(singular_values(J), axis=-1)
+
+
+def condition_number(J):
+    ''' Ratio of the largest to the smallest singular value of a stack of
+        Jacobians with shape (..., m, n); infinite at singularities. '''
+    σ = singular_values(J)
+    with np.errstate(divide='ignore'):
+        return σ[..., 0] / σ[..., -1]
+
+
+class ManipulabilityMap:
+    ''' Jacobian metrics of a model over a periodic grid of its two arm joint
+        angles θ1 and θ2, the last two joints of the model.
+
+        For both ThreeInputModel and TopDownHolonomicModel the metrics do not
+        depend on the other joints (the base position does not appear in the
+        Jacobian and the base heading only rotates it), so the map covers the
+        whole joint space. Use compute to build a map, or load_map to reuse
+        maps cached on disk. '''
+    def __init__(self, singular_values, arm_only=False):
+        self.resolution = singular_values.shape[0]
+        self.arm_only = arm_only
+        self.angles = np.linspace(-np.pi, np.pi, self.resolution, endpoint=False)
+
+        self.singular_values = singular_values
+        self.manipulability = np.prod(singular_values, axis=-1)
+        with np.errstate(divide='ignore'):
+            self.condition_number = singular_values[..., 0] / singular_values[..., -1]
+
+    @classmethod
+    def compute(cls, model, resolution=MAP_RESOLUTION, arm_only=False):
+        ''' Compute the map of model in one batched pass over a grid with
+            resolution points per joint. If arm_only is True, the metrics are
+            those of the Jacobian of the arm joints alone. '''
+        angles = np.linspace(-np.pi, np.pi, resolution, endpoint=False)
+        Q = np.zeros((resolution, resolution, model.ni))
+        Q[..., -2], Q[..., -1] = np.meshgrid(angles, angles, indexing='ij')
+
+        J = model.jacobian_batch(Q)
+        if arm_only:
+            J = J[..., -2:]
+        return cls(singular_values(J), arm_only)
+
+    def lookup(self, Q, metric='manipulability'):
+        ''' Bilinearly interpolate a metric at configurations Q with shape
+            (..., ni). Returns shape Q.shape[:-1], with an extra trailing axis
+            for the singular values. '''
+        if metric not in METRICS:
+            raise ValueError('Unknown metric {}; expected one of {}.'.format(
+                metric, METRICS))
+        values = getattr(self, metric)
+        Q = np.asarray(Q)
+
+        # fractional grid indices, wrapped around the periodic grid
+        step = 2 * np.pi / self.resolution
+        x1 = (Q[..., -2] + np.pi) / step
+        x2 = (Q[..., -1] + np.pi) / step
+        i1 = np.floor(x1).astype(int)
+        i2 = np.floor(x2).astype(int)
+        a1 = x1 - i1
+        a2 = x2 - i2
+        n = self.resolution
+        i1, j1 = i1 % n, (i1 + 1) % n
+        i2, j2 = i2 % n, (i2 + 1) % n
+
+        if values.ndim > 2:
+            a1 = a1[..., None]
+            a2 = a2[..., None]
+        return (1 - a1) * (1 - a2) * values[i1, i2] \
+                + a1 * (1 - a2) * values[j1, i2] \
+                + (1 - a1) * a2 * values[i1, j2] \
+                + a1 * a2 * values[j1, j2]
+
+    def save(self, path):
+        np.savez(path, singular_values=self.singular_values,
+                 arm_only=self.arm_only)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data['singular_values'], bool(data['arm_only']))
+
+
+def _map_key(model, resolution, arm_only):
+    ''' Name of the cache file for a map, which identifies everything the
+        Jacobian depends on. '''
+    desc = '{} l1={!r} l2={!r} outputs={} resolution={} arm_only={}'.format(
+        type(model).__name__, float(model.l1), float(model.l2),
+        list(model.output_idx), resolution, arm_only)
+    return hashlib.sha1(desc.encode()).hexdigest()[:16] + '.npz'
+
+
+def load_map(model, resolution=MAP_RESOLUTION, arm_only=False,
+             cache_dir=MAP_CACHE_DIR):
+    ''' Manipulability map of model, loaded from cache_dir if it was computed
+        before and otherwise computed and saved there. Pass cache_dir=None to
+        skip the cache. '''
+    if cache_dir is None:
+        return ManipulabilityMap.compute(model, resolution, arm_only)
+
+    path = os.path.join(cache_dir, _map_key(model, resolution, arm_only))
+    if os.path.exists(path):
+        return ManipulabilityMap.load(path)
+
+    mmap = ManipulabilityMap.compute(model, resolution, arm_only)
+    os.makedirs(cache_dir, exist_ok=True)
+    mmap.save(path)
+    return mmap
@@ -4,5 +4,13 @@
 # evolution.
 from .objects import InvertedPendulum
 from .topdown import TopDownHolonomicModel
-from .topdown_ad import TopDownHolonomicModelAD
 from .side import ThreeInputModel
+
+
+def __getattr__(name):
+    # The AD model depends on JAX, which is slow to import, so it is only
+    # loaded when it is actually requested.
+    if name == 'TopDownHolonomicModelAD':
+        from .topdown_ad import TopDownHolonomicModelAD
+        return TopDownHolonomicModelAD
+    raise AttributeError('module {} has no attribute {}'.format(__name__, name))
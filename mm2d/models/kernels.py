@@ -0,0 +1,152 @@
+# Compiled scalar kernels for the hot per-configuration model functions.
+# The NumPy implementations of these functions are dominated by call overhead
+# for their tiny outputs, so here they are written as plain loops over scalars
+# and compiled with numba. Each kernel writes its result into a caller-provided
+# output buffer; rows selects which outputs [x, y, θ] of the kinematic
+# functions are written.
+#
+# This module requires numba. Models only import it when the 'numba' backend
+# is selected (see util.load_kernels).
+import math
+
+import numba
+
+
+@numba.njit(cache=True)
+def three_input_forward(q, lx, ly, l1, l2, rows, out):
+    θ12 = q[1] + q[2]
+    for i in range(rows.shape[0]):
+        r = rows[i]
+        if r == 0:
+            out[i] = lx + q[0] + l1*math.cos(q[1]) + l2*math.cos(θ12)
+        elif r == 1:
+            out[i] = ly + l1*math.sin(q[1]) + l2*math.sin(θ12)
+        else:
+            out[i] = θ12
+
+
+@numba.njit(cache=True)
+def three_input_jacobian(q, l1, l2, rows, out):
+    θ12 = q[1] + q[2]
+    for i in range(rows.shape[0]):
+        r = rows[i]
+        if r == 0:
+            a = -l2*math.sin(θ12)
+            out[i, 0] = 1
+            out[i, 1] = -l1*math.sin(q[1]) + a
+            out[i, 2] = a
+        elif r == 1:
+            a = l2*math.cos(θ12)
+            out[i, 0] = 0
+            out[i, 1] = l1*math.cos(q[1]) + a
+            out[i, 2] = a
+        else:
+            out[i, 0] = 0
+            out[i, 1] = 1
+            out[i, 2] = 1
+
+
+@numba.njit(cache=True)
+def three_input_dJdt(q, dq, l1, l2, rows, out):
+    θ12 = q[1] + q[2]
+    dθ12 = dq[1] + dq[2]
+    for i in range(rows.shape[0]):
+        r = rows[i]
+        out[i, 0] = 0
+        if r == 0:
+            a = -l2*math.cos(θ12)*dθ12
+            out[i, 1] = -l1*math.cos(q[1])*dq[1] + a
+            out[i, 2] = a
+        elif r == 1:
+            a = -l2*math.sin(θ12)*dθ12
+            out[i, 1] = -l1*math.sin(q[1])*dq[1] + a
+            out[i, 2] = a
+        else:
+            out[i, 1] = 0
+            out[i, 2] = 0
+
+
+@numba.njit(cache=True)
+def three_input_mass_matrix(q, mb, m1, m2, l1, l2, I1, I2, out):
+    s1 = math.sin(q[1])
+    c2 = math.cos(q[2])
+    s12 = math.sin(q[1] + q[2])
+
+    out[0, 0] = mb + m1 + m2
+    out[0, 1] = out[1, 0] = -(0.5*m1 + m2)*l1*s1 - 0.5*m2*l2*s12
+    out[0, 2] = out[2, 0] = -0.5*m2*l2*s12
+    out[1, 1] = (0.25*m1 + m2)*l1**2 + 0.25*m2*l2**2 + m2*l1*l2*c2 + I1 + I2
+    out[1, 2] = out[2, 1] = 0.5*m2*l2*(0.5*l2 + l1*c2) + I2
+    out[2, 2] = 0.25*m2*l2**2 + I2
+
+
+@numba.njit(cache=True)
+def three_input_gravity_vector(q, m1, m2, l1, l2, gravity, out):
+    c1 = math.cos(q[1])
+    c12 = math.cos(q[1] + q[2])
+
+    out[0] = 0
+    out[1] = (0.5*m1 + m2)*gravity*l1*c1 + 0.5*m2*l2*gravity*c12
+    out[2] = 0.5*m2*l2*gravity*c12
+
+
+@numba.njit(cache=True)
+def topdown_forward(q, l1, l2, rows, out):
+    θb1 = q[2] + q[3]
+    θb12 = θb1 + q[4]
+    for i in range(rows.shape[0]):
+        r = rows[i]
+        if r == 0:
+            out[i] = q[0] + l1*math.cos(θb1) + l2*math.cos(θb12)
+        elif r == 1:
+            out[i] = q[1] + l1*math.sin(θb1) + l2*math.sin(θb12)
+        else:
+            out[i] = θb12
+
+
+@numba.njit(cache=True)
+def topdown_jacobian(q, l1, l2, rows, out):
+    θb1 = q[2] + q[3]
+    θb12 = θb1 + q[4]
+    for i in range(rows.shape[0]):
+        r = rows[i]
+        if r == 0:
+            a = -l2*math.sin(θb12)
+            b = -l1*math.sin(θb1) + a
+            out[i, 0] = 1
+            out[i, 1] = 0
+        elif r == 1:
+            a = l2*math.cos(θb12)
+            b = l1*math.cos(θb1) + a
+            out[i, 0] = 0
+            out[i, 1] = 1
+        else:
+            a = b = 1
+            out[i, 0] = 0
+            out[i, 1] = 0
+        out[i, 2] = b
+        out[i, 3] = b
+        out[i, 4] = a
+
+
+@numba.njit(cache=True)
+def topdown_dJdt(q, dq, l1, l2, rows, out):
+    θb1 = q[2] + q[3]
+    θb12 = θb1 + q[4]
+    dθb1 = dq[2] + dq[3]
+    dθb12 = dθb1 + dq[4]
+    for i in range(rows.shape[0]):
+        r = rows[i]
+        if r == 0:
+            a = -l2*math.cos(θb12)*dθb12
+            b = -l1*math.cos(θb1)*dθb1 + a
+        elif r == 1:
+            a = -l2*math.sin(θb12)*dθb12
+            b = -l1*math.sin(θb1)*dθb1 + a
+        else:
+            a = b = 0
+        out[i, 0] = 0
+        out[i, 1] = 0
+        out[i, 2] = b
+        out[i, 3] = b
+        out[i, 4] = a
@@ -2,6 +2,10 @@ import numpy as np
 
 
 class InvertedPendulum:
+    ''' Inverted pendulum on a cart (the cart is the robot's end effector).
+        State X = [angle, dangle, x, dx], input u = ddx. All methods also
+        accept a batch of states with shape (B, 4) and inputs with shape
+        (B,). '''
     def __init__(self, length, mass, gravity=9.81):
         self.length = length
         self.mass = mass
@@ -14,27 +18,73 @@ class InvertedPendulum:
                            [0, 0, 0, 0]])
         self.B = np.array([0, 1/length, 0, 1])
 
+        # exact discretizations of the linearized system, keyed by timestep
+        self._discretizations = {}
+
     def calc_force(self, X, x_acc):
-        angle = X[0]
+        angle = X[..., 0]
         s = np.sin(angle)
         c = np.cos(angle)
         acc_normal = self.gravity * c - x_acc * s
 
         # force exerted on the EE by the pendulum
-        f = np.array([self.mass * acc_normal * s, -self.mass * acc_normal * c])
+        f = np.stack((self.mass * acc_normal * s, -self.mass * acc_normal * c),
+                     axis=-1)
 
         return f
 
-    def step(self, X, u, dt):
-        ''' State X = [angle, dangle, x, dx], input u = ddx '''
-        angle = X[0]
+    def dynamics(self, X, u):
+        ''' Time derivative of the state under the nonlinear dynamics. '''
+        angle = X[..., 0]
         s = np.sin(angle)
         c = np.cos(angle)
 
         acc_tangential = self.gravity * s + u * c
         angle_acc = acc_tangential / self.length
 
-        dX = np.array([X[1], angle_acc, X[3], u])
-        X = X + dt * dX
+        return np.stack((X[..., 1], angle_acc, X[..., 3], u * np.ones_like(angle)),
+                        axis=-1)
+
+    def step(self, X, u, dt, integrator='euler'):
+        ''' Step the nonlinear model forward one timestep, holding u constant.
+            integrator is either 'euler' (forward Euler) or 'rk4' (classic
+            fourth-order Runge-Kutta). '''
+        if integrator == 'euler':
+            return X + dt * self.dynamics(X, u)
+        elif integrator == 'rk4':
+            k1 = self.dynamics(X, u)
+            k2 = self.dynamics(X + 0.5*dt*k1, u)
+            k3 = self.dynamics(X + 0.5*dt*k2, u)
+            k4 = self.dynamics(X + dt*k3, u)
+            return X + dt * (k1 + 2*k2 + 2*k3 + k4) / 6
+        raise ValueError('Unknown integrator {}.'.format(integrator))
+
+    def discretize(self, dt):
+        ''' Exact zero-order-hold discretization (Ad, Bd) of the linearized
+            system, such that X[k+1] = Ad @ X[k] + Bd * u[k]. The result is
+            cached for each timestep. '''
+        try:
+            return self._discretizations[dt]
+        except KeyError:
+            pass
+
+        # imported here since scipy is slow to import and only needed once
+        # per timestep
+        from scipy.linalg import expm
+
+        # matrix exponential of the augmented system [[A, B], [0, 0]]
+        n = self.A.shape[0]
+        G = np.zeros((n + 1, n + 1))
+        G[:n, :n] = self.A
+        G[:n, n] = self.B
+        Φ = expm(G * dt)
+        Ad, Bd = Φ[:n, :n], Φ[:n, n]
+
+        self._discretizations[dt] = (Ad, Bd)
+        return Ad, Bd
 
-        return X
+    def step_linearized(self, X, u, dt):
+        ''' Step the linearized model forward one timestep using its exact
+            discretization. '''
+        Ad, Bd = self.discretize(dt)
+        return X @ Ad.T + np.multiply.outer(u, Bd)
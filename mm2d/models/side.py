@@ -1,7 +1,10 @@
 # Two-dimensional model of a mobile manipulator, with a base and two link arm.
 # Kinematic and dynamic models are provided.
+import math
+
 import numpy as np
-from mm2d.util import bound_array
+from mm2d.util import (bound_array, bounded_rollout, ConfigurationCache,
+                       load_kernels, two_link_ik, wrap_to_pi)
 
 # default parameters
 Mb = 10
@@ -24,6 +27,64 @@ VEL_LIM = 1
 ACC_LIM = 1
 TAU_LIM = 100
 
+# number of configurations for which trigonometric terms are cached
+TRIG_CACHE_SIZE = 8
+
+# fixed-step integrators available for torque-level simulation
+INTEGRATORS = ('euler', 'semi_implicit', 'rk4')
+
+# default body sampling for collision checking
+LINK_SAMPLES = 1       # points per arm link, evenly spaced up to its end
+BASE_SAMPLES = 3       # points per sampled base edge, including corners
+BASE_EDGES = ('top',)  # base edges to sample: top, bottom, left, right
+
+# joints that rotate link 1 and link 2, respectively: the EE position depends
+# on the joints only through the absolute link angles
+LINK1_JOINTS = np.array([0, 1, 0])
+LINK2_JOINTS = np.array([0, 1, 1])
+
+# fraction of the arm's full extension used when choosing the base position in
+# inverse kinematics, to keep the arm away from the outstretched singularity
+IK_REACH = 0.9
+
+# inertial parameters in which the dynamics are linear, in the order of the
+# columns of the regressor
+DYNAMIC_PARAMETERS = ('mb', 'm1', 'm2', 'I1', 'I2')
+
+# functions replaced by compiled kernels when a compiled backend is selected
+COMPILED_FUNCTIONS = ('forward', 'jacobian', 'dJdt', 'mass_matrix',
+                      'gravity_vector')
+
+
+class ThreeInputTrig:
+    ''' Sines and cosines of the joint angles of ThreeInputModel, computed once
+        per configuration and shared between kinematic and dynamic
+        quantities. Works on a single q or on a stack of configurations with
+        shape (..., 3). '''
+    def __init__(self, q):
+        self.update(q)
+
+    def update(self, q):
+        ''' Recompute the terms in place for a new configuration. '''
+        if np.ndim(q) == 1:
+            # plain floats are much cheaper than NumPy scalars
+            θ1 = float(q[1])
+            θ2 = float(q[2])
+            θ12 = θ1 + θ2
+            sin, cos = math.sin, math.cos
+        else:
+            θ1 = q[..., 1]
+            θ2 = q[..., 2]
+            θ12 = θ1 + θ2
+            sin, cos = np.sin, np.cos
+
+        self.s1 = sin(θ1)
+        self.c1 = cos(θ1)
+        self.s2 = sin(θ2)
+        self.c2 = cos(θ2)
+        self.s12 = sin(θ12)
+        self.c12 = cos(θ12)
+
 
 class ThreeInputModel:
     """Three-input 2D mobile manipulator kinematic and dynamic model.
@@ -34,7 +95,9 @@ class ThreeInputModel:
     """
     def __init__(self, bh=Bh, bw=Bw, lx=Lx, ly=Ly, l1=L1, l2=L2, mb=Mb, m1=M1,
                  m2=M2, gravity=G, vel_lim=VEL_LIM, acc_lim=ACC_LIM,
-                 tau_lim=TAU_LIM, output_idx=[0, 1, 2]):
+                 tau_lim=TAU_LIM, output_idx=[0, 1, 2],
+                 link_samples=LINK_SAMPLES, base_samples=BASE_SAMPLES,
+                 base_edges=BASE_EDGES, backend='numpy'):
         self.ni = 3  # number of joints (inputs/DOFs)
 
         # control which outputs are used
@@ -67,34 +130,246 @@ class ThreeInputModel:
         self.vel_lim = vel_lim
         self.acc_lim = acc_lim
 
-    def forward(self, q):
-        ''' Forward kinematic transform for the end effector. '''
-        p = np.array([
-            self.lx + q[0] + self.l1*np.cos(q[1]) + self.l2*np.cos(q[1]+q[2]),
-            self.ly + self.l1*np.sin(q[1]) + self.l2*np.sin(q[1]+q[2]),
-            q[1] + q[2]])
-        return p[self.output_idx]
-
-    def jacobian(self, q):
-        ''' End effector Jacobian. '''
-        J = np.array([
-            [1, -self.l1*np.sin(q[1])-self.l2*np.sin(q[1]+q[2]), -self.l2*np.sin(q[1]+q[2])],
-            [0,  self.l1*np.cos(q[1])+self.l2*np.cos(q[1]+q[2]),  self.l2*np.cos(q[1]+q[2])],
-            [0, 1, 1]])
-        return J[self.output_idx, :]
+        # Evaluation context: trigonometric terms are computed once per
+        # configuration and reused by all kinematic and dynamic functions
+        # queried at the same q.
+        self.trig = ConfigurationCache(ThreeInputTrig, maxsize=TRIG_CACHE_SIZE)
+
+        # scratch buffers for the full forward kinematics and Jacobian, from
+        # which the selected outputs are copied when an out array is given
+        self._p_full = np.empty(3)
+        self._J_full = np.array([[1., 0, 0], [0, 0, 0], [0, 1, 1]])
+
+        self.set_body_sampling(link_samples, base_samples, base_edges)
+        self.set_backend(backend)
+
+    def set_backend(self, backend):
+        ''' Select the implementation of the hot per-configuration functions
+            forward, jacobian, dJdt, mass_matrix and gravity_vector: 'numpy',
+            or 'numba' for compiled kernels that avoid NumPy's per-call
+            overhead. Falls back to NumPy with a warning if numba is not
+            installed; the backend actually in use is stored in
+            self.backend. '''
+        self._kernels = load_kernels(backend)
+        self.backend = 'numpy' if self._kernels is None else backend
+        self._output_rows = np.array(self.output_idx, dtype=np.int64)
+
+        # the compiled versions shadow the NumPy methods on this instance
+        for name in COMPILED_FUNCTIONS:
+            if self._kernels is None:
+                self.__dict__.pop(name, None)
+            else:
+                setattr(self, name, getattr(self, '_compiled_' + name))
+
+    def __getstate__(self):
+        # the kernel module and the compiled methods bound to this instance
+        # cannot be pickled, so only the backend name is kept and they are
+        # set up again on load
+        state = self.__dict__.copy()
+        state.pop('_kernels', None)
+        for name in COMPILED_FUNCTIONS:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.set_backend(self.backend)
+
+    def _compiled_forward(self, q, out=None):
+        p = np.empty(self.no) if out is None else out
+        self._kernels.three_input_forward(q, self.lx, self.ly, self.l1,
+                                          self.l2, self._output_rows, p)
+        return p
+
+    def _compiled_jacobian(self, q, out=None):
+        J = np.empty((self.no, 3)) if out is None else out
+        self._kernels.three_input_jacobian(q, self.l1, self.l2,
+                                           self._output_rows, J)
+        return J
+
+    def _compiled_dJdt(self, q, dq):
+        dJ = np.empty((self.no, 3))
+        self._kernels.three_input_dJdt(q, dq, self.l1, self.l2,
+                                       self._output_rows, dJ)
+        return dJ
+
+    def _compiled_mass_matrix(self, q):
+        if np.ndim(q) > 1:
+            return ThreeInputModel.mass_matrix(self, q)
+        M = np.empty((3, 3))
+        self._kernels.three_input_mass_matrix(q, self.mb, self.m1, self.m2,
+                                              self.l1, self.l2, self.I1,
+                                              self.I2, M)
+        return M
+
+    def _compiled_gravity_vector(self, q):
+        if np.ndim(q) > 1:
+            return ThreeInputModel.gravity_vector(self, q)
+        g = np.empty(3)
+        self._kernels.three_input_gravity_vector(q, self.m1, self.m2, self.l1,
+                                                 self.l2, self.gravity, g)
+        return g
+
+    def _trig_terms(self, q):
+        ''' Trigonometric terms of a single configuration (cached) or of a
+            stack of configurations (computed directly). '''
+        if np.ndim(q) == 1:
+            return self.trig(q)
+        return ThreeInputTrig(np.asarray(q))
+
+    def forward(self, q, out=None):
+        ''' Forward kinematic transform for the end effector. If out is given,
+            the result is written into it rather than a new array. '''
+        t = self.trig(q)
+        p = self._p_full
+        p[0] = self.lx + q[0] + self.l1*t.c1 + self.l2*t.c12
+        p[1] = self.ly + self.l1*t.s1 + self.l2*t.s12
+        p[2] = q[1] + q[2]
+        if out is None:
+            return p[self._output_rows]
+        return np.take(p, self._output_rows, axis=0, out=out, mode='clip')
+
+    def jacobian(self, q, out=None):
+        ''' End effector Jacobian. If out is given, the result is written into
+            it rather than a new array. '''
+        t = self.trig(q)
+        J = self._J_full
+        J[0, 2] = -self.l2*t.s12
+        J[0, 1] = -self.l1*t.s1 + J[0, 2]
+        J[1, 2] = self.l2*t.c12
+        J[1, 1] = self.l1*t.c1 + J[1, 2]
+        if out is None:
+            return J[self._output_rows, :]
+        return np.take(J, self._output_rows, axis=0, out=out, mode='clip')
 
     def dJdt(self, q, dq):
         ''' Derivative of EE Jacobian w.r.t. time. '''
-        q12 = q[1] + q[2]
+        t = self.trig(q)
         dq12 = dq[1] + dq[2]
         J = np.array([
-            [0, -self.l1*np.cos(q[1])*dq[1]-self.l2*np.cos(q12)*dq12, -self.l2*np.cos(q12)*dq12],
-            [0, -self.l1*np.sin(q[1])*dq[1]-self.l2*np.sin(q12)*dq12, -self.l2*np.sin(q12)*dq12],
+            [0, -self.l1*t.c1*dq[1]-self.l2*t.c12*dq12, -self.l2*t.c12*dq12],
+            [0, -self.l1*t.s1*dq[1]-self.l2*t.s12*dq12, -self.l2*t.s12*dq12],
             [0, 0, 0]])
         return J[self.output_idx, :]
 
+    def forward_batch(self, Q):
+        ''' Forward kinematics for many configurations at once. Q has shape
+            (..., 3); returns shape (..., no). '''
+        Q = np.asarray(Q)
+        t = self._trig_terms(Q)
+        P = np.empty(Q.shape[:-1] + (3,))
+        P[..., 0] = self.lx + Q[..., 0] + self.l1*t.c1 + self.l2*t.c12
+        P[..., 1] = self.ly + self.l1*t.s1 + self.l2*t.s12
+        P[..., 2] = Q[..., 1] + Q[..., 2]
+        return P[..., self.output_idx]
+
+    def jacobian_batch(self, Q):
+        ''' EE Jacobians for many configurations at once. Q has shape
+            (..., 3); returns shape (..., no, 3). '''
+        Q = np.asarray(Q)
+        t = self._trig_terms(Q)
+        J = np.zeros(Q.shape[:-1] + (3, 3))
+        J[..., 0, 0] = 1
+        J[..., 0, :] += np.multiply.outer(-self.l1*t.s1, LINK1_JOINTS) \
+                + np.multiply.outer(-self.l2*t.s12, LINK2_JOINTS)
+        J[..., 1, :] = np.multiply.outer(self.l1*t.c1, LINK1_JOINTS) \
+                + np.multiply.outer(self.l2*t.c12, LINK2_JOINTS)
+        J[..., 2, :] = LINK2_JOINTS
+        return J[..., self.output_idx, :]
+
+    def hessian(self, q):
+        ''' Second-order kinematics of the EE: H[i, j, k] is the derivative
+            of J[i, j] with respect to q[k], so that dJdt = H @ dq. Also
+            accepts a stack of configurations with shape (..., 3), returning
+            shape (..., no, 3, 3). '''
+        t = self._trig_terms(q)
+        E1 = np.outer(LINK1_JOINTS, LINK1_JOINTS)
+        E2 = np.outer(LINK2_JOINTS, LINK2_JOINTS)
+
+        H = np.zeros(np.shape(t.s1) + (3, 3, 3))
+        H[..., 0, :, :] = -np.multiply.outer(self.l1*t.c1, E1) \
+                - np.multiply.outer(self.l2*t.c12, E2)
+        H[..., 1, :, :] = -np.multiply.outer(self.l1*t.s1, E1) \
+                - np.multiply.outer(self.l2*t.s12, E2)
+        return H[..., self.output_idx, :, :]
+
+    def dJdt_batch(self, Q, dQ):
+        ''' Time-derivative of the EE Jacobian for many states at once,
+            computed from the analytic Hessian. '''
+        return np.einsum('...ijk,...k->...ij', self.hessian(Q), dQ)
+
+    def inverse_kinematics(self, P, q_nominal=None, elbow_up=True, reach=IK_REACH):
+        ''' Closed-form inverse kinematics, vectorized over targets P with
+            shape (..., no). The outputs must be [x, y] or [x, y, θ].
+
+            For position targets the base position is redundant: it is chosen
+            as close as possible to that of q_nominal such that the target is
+            within reach*(l1+l2) of the shoulder. Without a nominal
+            configuration the base is placed so that the arm reaches forward
+            to the middle of that range. For full pose targets the solution is
+            unique up to the arm branch. elbow_up selects the branch with
+            θ2 <= 0 (θ2 >= 0 if False). Some full poses can only be reached
+            with one elbow sign, in which case that branch is returned
+            regardless of elbow_up.
+
+            Returns the configurations, with shape (..., 3), and a mask of the
+            targets that could be reached exactly. '''
+        P = np.asarray(P, dtype=np.float64)
+        x = P[..., 0] - self.lx
+        y = P[..., 1] - self.ly
+
+        if list(self.output_idx) == [0, 1]:
+            # range of horizontal distances between shoulder and target
+            rmin = abs(self.l1 - self.l2)
+            rmax = reach * (self.l1 + self.l2)
+            dx_min = np.sqrt(np.maximum(rmin**2 - y**2, 0))
+            dx_max = np.sqrt(np.maximum(rmax**2 - y**2, 0))
+
+            if q_nominal is None:
+                dx = 0.5 * (dx_min + dx_max)
+            else:
+                dx0 = x - np.asarray(q_nominal)[..., 0]
+                sign = np.where(dx0 < 0, -1, 1)
+                dx = sign * np.clip(np.abs(dx0), dx_min, dx_max)
+
+            θ1, θ2, reachable = two_link_ik(dx, y, self.l1, self.l2, elbow_up)
+            xb = x - dx
+        elif list(self.output_idx) == [0, 1, 2]:
+            # the wrist position is fixed by the target orientation, and its
+            # height in turn fixes the sine of θ1
+            θ = P[..., 2]
+            xw = x - self.l2 * np.cos(θ)
+            yw = y - self.l2 * np.sin(θ)
+            s1 = yw / self.l1
+            reachable = np.abs(s1) <= 1
+
+            θ1a = np.arcsin(np.clip(s1, -1, 1))
+            θ1b = np.pi - θ1a
+            θ2a = wrap_to_pi(θ - θ1a)
+            θ2b = wrap_to_pi(θ - θ1b)
+            # use the branch with the requested elbow sign; if both or
+            # neither have it, the one with the smaller elbow angle
+            a_ok = (θ2a <= 0) == elbow_up
+            b_ok = (θ2b <= 0) == elbow_up
+            use_a = np.where(a_ok == b_ok, np.abs(θ2a) <= np.abs(θ2b), a_ok)
+
+            θ1 = wrap_to_pi(np.where(use_a, θ1a, θ1b))
+            θ2 = np.where(use_a, θ2a, θ2b)
+            xb = xw - self.l1 * np.cos(θ1)
+        else:
+            raise ValueError('Inverse kinematics requires outputs [x, y] or '
+                             '[x, y, θ], not {}.'.format(self.output_idx))
+
+        Q = np.stack(np.broadcast_arrays(xb, θ1, θ2), axis=-1)
+        return Q, reachable
+
     def base_corners(self, q):
-        ''' Calculate the corners of the base of the robot. '''
+        ''' Calculate the corners of the base of the robot. A stack of
+            configurations is passed on to base_corners_batch. '''
+        if np.ndim(q) > 1:
+            ps = self.base_corners_batch(q)
+            return ps[..., 0], ps[..., 1]
+
         x0 = q[0]
         y0 = 0
         r = self.bw * 0.5
@@ -106,20 +381,56 @@ class ThreeInputModel:
         return x, y
 
     def arm_points(self, q):
-        ''' Calculate points on the arm. '''
+        ''' Calculate points on the arm. A stack of configurations is passed
+            on to arm_points_batch. '''
+        if np.ndim(q) > 1:
+            ps = self.arm_points_batch(q)
+            return ps[..., 0], ps[..., 1]
+
+        t = self.trig(q)
         x0 = q[0] + self.lx
-        x1 = x0 + self.l1*np.cos(q[1])
-        x2 = x1 + self.l2*np.cos(q[1]+q[2])
+        x1 = x0 + self.l1*t.c1
+        x2 = x1 + self.l2*t.c12
 
         y0 = self.ly
-        y1 = y0 + self.l1*np.sin(q[1])
-        y2 = y1 + self.l2*np.sin(q[1]+q[2])
+        y1 = y0 + self.l1*t.s1
+        y2 = y1 + self.l2*t.s12
 
         x = np.array([x0, x1, x2])
         y = np.array([y0, y1, y2])
 
         return x, y
 
+    def base_corners_batch(self, Q):
+        ''' Corners of the base for a whole trajectory of configurations at
+            once. Q has shape (..., 3); returns an array of shape (..., 4, 2),
+            ordered around the base starting from the top left. '''
+        Q = np.asarray(Q)
+        r = self.bw * 0.5
+        h = self.bh
+        corners = np.array([[-r, 0], [-r, -h], [r, -h], [r, 0]])
+
+        ps = np.empty(Q.shape[:-1] + (4, 2))
+        ps[..., 0] = Q[..., None, 0] + corners[:, 0]
+        ps[..., 1] = corners[:, 1]
+        return ps
+
+    def arm_points_batch(self, Q):
+        ''' Shoulder, elbow, and end effector positions for a whole trajectory
+            of configurations at once. Q has shape (..., 3); returns an array
+            of shape (..., 3, 2). '''
+        Q = np.asarray(Q)
+        t = self._trig_terms(Q)
+
+        ps = np.empty(Q.shape[:-1] + (3, 2))
+        ps[..., 0, 0] = Q[..., 0] + self.lx
+        ps[..., 0, 1] = self.ly
+        ps[..., 1, 0] = ps[..., 0, 0] + self.l1*t.c1
+        ps[..., 1, 1] = ps[..., 0, 1] + self.l1*t.s1
+        ps[..., 2, 0] = ps[..., 1, 0] + self.l2*t.c12
+        ps[..., 2, 1] = ps[..., 1, 1] + self.l2*t.s12
+        return ps
+
     def sample_points(self, q):
         ''' Sample points across the robot body. '''
         ax, ay = self.arm_points(q)
@@ -133,50 +444,163 @@ class ThreeInputModel:
 
     def sample_jacobians(self, q):
         ''' Jacobians of points sampled across the robot body. '''
+        t = self.trig(q)
         Js = np.zeros((5, 2, 3))
         Js[0, :, :] = Js[1, :, :] = Js[2, :, :] = np.array([[1, 0, 0], [0, 0, 0]])
         Js[3, :, :] = np.array([
-            [1, -self.l1*np.sin(q[1]), 0],
-            [0,  self.l1*np.cos(q[1]), 0]])
+            [1, -self.l1*t.s1, 0],
+            [0,  self.l1*t.c1, 0]])
         Js[4, :, :] = np.array([
-            [1, -self.l1*np.sin(q[1])-self.l2*np.sin(q[1]+q[2]), -self.l2*np.sin(q[1]+q[2])],
-            [0,  self.l1*np.cos(q[1])+self.l2*np.cos(q[1]+q[2]),  self.l2*np.cos(q[1]+q[2])]])
+            [1, -self.l1*t.s1-self.l2*t.s12, -self.l2*t.s12],
+            [0,  self.l1*t.c1+self.l2*t.c12,  self.l2*t.c12]])
         return Js
 
     def sample_dJdt(self, q, dq):
         ''' Time-derivative of Jacobians of points sampled across the robot
             body. '''
+        t = self.trig(q)
         dJs = np.zeros((5, 2, 3))
         dJs[3, :, :] = np.array([
-            [0, -self.l1*np.cos(q[1])*dq[1], 0],
-            [0, -self.l1*np.sin(q[1])*dq[1], 0]])
-        q12 = q[1] + q[2]
+            [0, -self.l1*t.c1*dq[1], 0],
+            [0, -self.l1*t.s1*dq[1], 0]])
         dq12 = dq[1] + dq[2]
         dJs[4, :, :] = np.array([
-            [0, -self.l1*np.cos(q[1])*dq[1]-self.l2*np.cos(q12)*dq12, -self.l2*np.cos(q12)*dq12],
-            [0, -self.l1*np.sin(q[1])*dq[1]-self.l2*np.sin(q12)*dq12, -self.l2*np.sin(q12)*dq12]])
+            [0, -self.l1*t.c1*dq[1]-self.l2*t.c12*dq12, -self.l2*t.c12*dq12],
+            [0, -self.l1*t.s1*dq[1]-self.l2*t.s12*dq12, -self.l2*t.s12*dq12]])
+        return dJs
+
+    def set_body_sampling(self, link_samples=LINK_SAMPLES,
+                          base_samples=BASE_SAMPLES, base_edges=BASE_EDGES):
+        ''' Choose the points sampled across the robot body by the batched
+            sample_*_batch functions: base_samples points along each of the
+            base_edges and link_samples points along each arm link. Base
+            points come first, edge by edge, with the two ends of each edge
+            followed by its interior points. Then come the points of link 1
+            and then link 2, each ordered from the proximal to the distal end.
+            The default layout is thus the same points in the same order as
+            sample_points.
+
+            Every point has the form
+                p = [xb + ox + a1*l1*c1 + a2*l2*c12, oy + a1*l1*s1 + a2*l2*s12]
+            so the layout is stored as offsets (ox, oy) and link length
+            fractions (a1, a2). '''
+        r = 0.5 * self.bw
+        edges = {
+            'top':    ((-r, 0), (r, 0)),
+            'bottom': ((-r, -self.bh), (r, -self.bh)),
+            'left':   ((-r, 0), (-r, -self.bh)),
+            'right':  ((r, 0), (r, -self.bh)),
+        }
+        s_base = np.linspace(0, 1, base_samples)
+        if base_samples > 1:
+            s_base = np.concatenate(([0, 1], s_base[1:-1]))
+        base_offsets = [np.outer(1 - s_base, edges[edge][0])
+                        + np.outer(s_base, edges[edge][1]) for edge in base_edges]
+        num_base = base_samples * len(base_edges)
+
+        s_link = np.arange(1, link_samples + 1) / link_samples
+        num_pts = num_base + 2 * link_samples
+
+        offsets = np.zeros((num_pts, 2))
+        offsets[:num_base, :] = np.reshape(base_offsets, (num_base, 2))
+        offsets[num_base:, :] = [self.lx, self.ly]
+
+        a1 = np.zeros(num_pts)
+        a1[num_base:num_base+link_samples] = s_link
+        a1[num_base+link_samples:] = 1
+
+        a2 = np.zeros(num_pts)
+        a2[num_base+link_samples:] = s_link
+
+        self.sample_offsets = offsets
+        self.sample_a1 = a1
+        self.sample_a2 = a2
+        self.num_samples = num_pts
+
+    def sample_points_batch(self, Q):
+        ''' Points sampled across the robot body (see set_body_sampling) for
+            many configurations at once. Q has shape (..., 3); returns an
+            array of shape (..., num_samples, 2). '''
+        Q = np.asarray(Q)
+        t = ThreeInputTrig(Q[..., None, :])
+        a1 = self.sample_a1 * self.l1
+        a2 = self.sample_a2 * self.l2
+
+        ps = np.empty(Q.shape[:-1] + (self.num_samples, 2))
+        ps[..., 0] = Q[..., None, 0] + self.sample_offsets[:, 0] + a1*t.c1 + a2*t.c12
+        ps[..., 1] = self.sample_offsets[:, 1] + a1*t.s1 + a2*t.s12
+        return ps
+
+    def sample_jacobians_batch(self, Q):
+        ''' Jacobians of the sampled body points for many configurations at
+            once. Q has shape (..., 3); returns an array of shape
+            (..., num_samples, 2, 3). '''
+        Q = np.asarray(Q)
+        t = ThreeInputTrig(Q[..., None, :])
+        a1 = self.sample_a1 * self.l1
+        a2 = self.sample_a2 * self.l2
+
+        Js = np.empty(Q.shape[:-1] + (self.num_samples, 2, 3))
+        Js[..., 0, 0] = 1
+        Js[..., 1, 0] = 0
+        Js[..., 0, 2] = -a2*t.s12
+        Js[..., 1, 2] = a2*t.c12
+        Js[..., 0, 1] = -a1*t.s1 + Js[..., 0, 2]
+        Js[..., 1, 1] = a1*t.c1 + Js[..., 1, 2]
+        return Js
+
+    def sample_dJdt_batch(self, Q, dQ):
+        ''' Time-derivatives of the Jacobians of the sampled body points for
+            many states at once. Q and dQ have shape (..., 3); returns an
+            array of shape (..., num_samples, 2, 3). '''
+        Q = np.asarray(Q)
+        dQ = np.asarray(dQ)
+        t = ThreeInputTrig(Q[..., None, :])
+        a1 = self.sample_a1 * self.l1
+        a2 = self.sample_a2 * self.l2
+        dθ1 = dQ[..., None, 1]
+        dθ12 = dθ1 + dQ[..., None, 2]
+
+        dJs = np.empty(np.broadcast(Q, dQ).shape[:-1] + (self.num_samples, 2, 3))
+        dJs[..., 0] = 0
+        dJs[..., 0, 2] = -a2*t.c12*dθ12
+        dJs[..., 1, 2] = -a2*t.s12*dθ12
+        dJs[..., 0, 1] = -a1*t.c1*dθ1 + dJs[..., 0, 2]
+        dJs[..., 1, 1] = -a1*t.s1*dθ1 + dJs[..., 1, 2]
         return dJs
 
     def mass_matrix(self, q):
-        ''' Compute dynamic mass matrix. '''
-        xb, θ1, θ2 = q
-        θ12 = θ1 + θ2
+        ''' Compute dynamic mass matrix. Also accepts a stack of
+            configurations with shape (..., 3), returning shape (..., 3, 3). '''
+        t = self._trig_terms(q)
 
         m11 = self.mb + self.m1 + self.m2
-        m12 = -(0.5*self.m1+self.m2)*self.l1*np.sin(θ1) \
-                - 0.5*self.m2*self.l2*np.sin(θ12)
-        m13 = -0.5*self.m2*self.l2*np.sin(θ12)
+        m12 = -(0.5*self.m1+self.m2)*self.l1*t.s1 \
+                - 0.5*self.m2*self.l2*t.s12
+        m13 = -0.5*self.m2*self.l2*t.s12
 
         m22 = (0.25*self.m1+self.m2)*self.l1**2 + 0.25*self.m2*self.l2**2 \
-                + self.m2*self.l1*self.l2*np.cos(θ2) + self.I1 + self.I2
-        m23 = 0.5*self.m2*self.l2*(0.5*self.l2+self.l1*np.cos(θ2)) + self.I2
+                + self.m2*self.l1*self.l2*t.c2 + self.I1 + self.I2
+        m23 = 0.5*self.m2*self.l2*(0.5*self.l2+self.l1*t.c2) + self.I2
 
         m33 = 0.25*self.m2*self.l2**2 + self.I2
 
-        return np.array([
-            [m11, m12, m13],
-            [m12, m22, m23],
-            [m13, m23, m33]])
+        # a single configuration is by far the most common case, for which
+        # building the matrix directly is fastest
+        if isinstance(t.s1, float):
+            return np.array([
+                [m11, m12, m13],
+                [m12, m22, m23],
+                [m13, m23, m33]])
+
+        M = np.empty(np.shape(t.s1) + (3, 3))
+        M[..., 0, 0] = m11
+        M[..., 0, 1] = M[..., 1, 0] = m12
+        M[..., 0, 2] = M[..., 2, 0] = m13
+        M[..., 1, 1] = m22
+        M[..., 1, 2] = M[..., 2, 1] = m23
+        M[..., 2, 2] = m33
+        return M
 
     def christoffel_matrix(self, q):
         ''' Compute 3D matrix Γ of Christoffel symbols, as in the dynamic
@@ -184,24 +608,23 @@ class ThreeInputModel:
                 M @ ddq + dq @ Γ @ dq + g = τ.
             Note that C = dq @ Γ.
         '''
-        xb, θ1, θ2 = q
-        θ12 = θ1 + θ2
+        t = self.trig(q)
 
         # Partial derivatives of mass matrix
         dMdxb = np.zeros((3, 3))
 
-        dMdθ1_12 = -0.5*self.m1*self.l1*np.cos(θ1) \
-                - self.m2*self.l1*np.cos(θ1) - 0.5*self.m2*self.l2*np.cos(θ12)
-        dMdθ1_13 = -0.5*self.m2*self.l2*np.cos(θ12)
+        dMdθ1_12 = -0.5*self.m1*self.l1*t.c1 \
+                - self.m2*self.l1*t.c1 - 0.5*self.m2*self.l2*t.c12
+        dMdθ1_13 = -0.5*self.m2*self.l2*t.c12
         dMdθ1 = np.array([
             [0, dMdθ1_12, dMdθ1_13],
             [dMdθ1_12, 0, 0],
             [dMdθ1_13, 0, 0]])
 
-        dMdθ2_12 = -0.5*self.m2*self.l2*np.cos(θ12)
-        dMdθ2_13 = -0.5*self.m2*self.l2*np.cos(θ12)
-        dMdθ2_22 = -self.m2*self.l1*self.l2*np.sin(θ2)
-        dMdθ2_23 = -0.5*self.m2*self.l1*self.l2*np.sin(θ2)
+        dMdθ2_12 = -0.5*self.m2*self.l2*t.c12
+        dMdθ2_13 = -0.5*self.m2*self.l2*t.c12
+        dMdθ2_22 = -self.m2*self.l1*self.l2*t.s2
+        dMdθ2_23 = -0.5*self.m2*self.l1*self.l2*t.s2
         dMdθ2 = np.array([
             [0,        dMdθ2_12, dMdθ2_13],
             [dMdθ2_12, dMdθ2_22, dMdθ2_23],
@@ -215,14 +638,100 @@ class ThreeInputModel:
         return dMdq - 0.5*dMdq.T
 
     def gravity_vector(self, q):
-        ''' Calculate the gravity vector. '''
-        xb, θ1, θ2 = q
-        θ12 = θ1 + θ2
-        return np.array([
-            0,
-            (0.5*self.m1+self.m2)*self.gravity*self.l1*np.cos(θ1) \
-                    + 0.5*self.m2*self.l2*self.gravity*np.cos(θ12),
-            0.5*self.m2*self.l2*self.gravity*np.cos(θ12)])
+        ''' Calculate the gravity vector. Also accepts a stack of
+            configurations with shape (..., 3). '''
+        t = self._trig_terms(q)
+        g2 = 0.5*self.m2*self.l2*self.gravity*t.c12
+        g1 = (0.5*self.m1+self.m2)*self.gravity*self.l1*t.c1 + g2
+        if isinstance(g1, float):
+            return np.array([0, g1, g2])
+
+        g = np.empty(np.shape(g1) + (3,))
+        g[..., 0] = 0
+        g[..., 1] = g1
+        g[..., 2] = g2
+        return g
+
+    def coriolis_vector(self, q, dq):
+        ''' Coriolis and centrifugal terms dq @ Γ @ dq, computed in closed
+            form. Also accepts stacks of states with shape (..., 3). '''
+        t = self._trig_terms(q)
+        dθ1 = dq[..., 1]
+        dθ2 = dq[..., 2]
+        dθ12 = dθ1 + dθ2
+
+        h = np.empty(np.shape(dq))
+        h[..., 0] = -(0.5*self.m1+self.m2)*self.l1*t.c1*dθ1**2 \
+                - 0.5*self.m2*self.l2*t.c12*dθ12**2
+        h[..., 1] = -self.m2*self.l1*self.l2*t.s2*(dθ1*dθ2 + 0.5*dθ2**2)
+        h[..., 2] = 0.5*self.m2*self.l1*self.l2*t.s2*dθ1**2
+        return h
+
+    def forward_dynamics(self, q, dq, tau):
+        ''' Calculate the joint acceleration resulting from torque tau. Also
+            accepts stacks of states and torques with shape (..., 3). '''
+        M = self.mass_matrix(q)
+        rhs = tau - self.coriolis_vector(q, dq) - self.gravity_vector(q)
+        return np.linalg.solve(M, rhs[..., None])[..., 0]
+
+    def energy(self, q, dq):
+        ''' Total mechanical energy (kinetic plus gravitational potential) of
+            the robot. Also accepts stacks of states with shape (..., 3). '''
+        t = self._trig_terms(q)
+        M = self.mass_matrix(q)
+        T = 0.5 * np.einsum('...i,...ij,...j->...', dq, M, dq)
+        V = (0.5*self.m1+self.m2)*self.gravity*self.l1*t.s1 \
+                + 0.5*self.m2*self.l2*self.gravity*t.s12
+        return T + V
+
+    def regressor(self, q, dq, ddq):
+        ''' Regressor matrix Y of the inverse dynamics, which are linear in the
+            inertial parameters θ = [mb, m1, m2, I1, I2], such that
+                τ = Y @ θ.
+            Also accepts stacks of samples with shape (..., 3), returning shape
+            (..., 3, 5). '''
+        t = self._trig_terms(q)
+        l1, l2, G = self.l1, self.l2, self.gravity
+
+        ddxb, ddθ1, ddθ2 = ddq[..., 0], ddq[..., 1], ddq[..., 2]
+        dθ1, dθ2 = dq[..., 1], dq[..., 2]
+        dθ12 = dθ1 + dθ2
+
+        Y = np.zeros(np.broadcast(t.s1, ddxb, dθ1).shape + (3, 5))
+
+        # base
+        Y[..., 0, 0] = ddxb
+        Y[..., 0, 1] = ddxb - 0.5*l1*(t.s1*ddθ1 + t.c1*dθ1**2)
+        Y[..., 0, 2] = ddxb - (l1*t.s1 + 0.5*l2*t.s12)*ddθ1 \
+                - 0.5*l2*t.s12*ddθ2 - l1*t.c1*dθ1**2 - 0.5*l2*t.c12*dθ12**2
+
+        # first joint
+        Y[..., 1, 1] = -0.5*l1*t.s1*ddxb + 0.25*l1**2*ddθ1 + 0.5*G*l1*t.c1
+        Y[..., 1, 2] = -(l1*t.s1 + 0.5*l2*t.s12)*ddxb \
+                + (l1**2 + 0.25*l2**2 + l1*l2*t.c2)*ddθ1 \
+                + (0.25*l2**2 + 0.5*l1*l2*t.c2)*ddθ2 \
+                - l1*l2*t.s2*(dθ1*dθ2 + 0.5*dθ2**2) \
+                + G*(l1*t.c1 + 0.5*l2*t.c12)
+        Y[..., 1, 3] = ddθ1
+        Y[..., 1, 4] = ddθ1 + ddθ2
+
+        # second joint
+        Y[..., 2, 2] = -0.5*l2*t.s12*ddxb \
+                + (0.25*l2**2 + 0.5*l1*l2*t.c2)*ddθ1 + 0.25*l2**2*ddθ2 \
+                + 0.5*l1*l2*t.s2*dθ1**2 + 0.5*G*l2*t.c12
+        Y[..., 2, 4] = ddθ1 + ddθ2
+
+        return Y
+
+    def dynamic_parameters(self):
+        ''' Current inertial parameters θ = [mb, m1, m2, I1, I2]. '''
+        return np.array([getattr(self, name) for name in DYNAMIC_PARAMETERS])
+
+    def set_dynamic_parameters(self, θ):
+        ''' Set the inertial parameters θ = [mb, m1, m2, I1, I2], for example
+            to values identified from data. '''
+        for name, value in zip(DYNAMIC_PARAMETERS, θ):
+            setattr(self, name, float(value))
 
     def calc_torque(self, q, dq, ddq):
         ''' Calculate the required torque for the given joint positions,
@@ -233,19 +742,42 @@ class ThreeInputModel:
 
         return M @ ddq + dq @ Γ @ dq + g
 
-    def command_torque(self, q, dq, tau, dt):
+    def command_torque(self, q, dq, tau, dt, integrator='euler'):
         ''' Calculate the new state [q, dq] from current state [q, dq] and
-            torque input tau. '''
-        M = self.mass_matrix(q)
-        Γ = self.christoffel_matrix(q)
-        g = self.gravity_vector(q)
-
-        # solve for acceleration
-        ddq = np.linalg.solve(M, tau - dq @ Γ @ dq - g)
-
-        # integrate the state
-        q = q + dt * dq
-        dq = dq + dt * ddq
+            torque input tau, which is held constant over the timestep.
+
+            The integrator is one of:
+                euler:         explicit (forward) Euler
+                semi_implicit: semi-implicit Euler, which updates dq first
+                               and then integrates q using the new dq. It
+                               is not symplectic, because the mass matrix
+                               depends on q: its energy drift is of the
+                               same order as that of euler.
+                rk4:           classic fourth-order Runge-Kutta
+            The state and torque may also be batches with shape (B, 3), in
+            which case all B robots are stepped at once. '''
+        if integrator == 'euler':
+            ddq = self.forward_dynamics(q, dq, tau)
+            q = q + dt * dq
+            dq = dq + dt * ddq
+        elif integrator == 'semi_implicit':
+            ddq = self.forward_dynamics(q, dq, tau)
+            dq = dq + dt * ddq
+            q = q + dt * dq
+        elif integrator == 'rk4':
+            k1q = dq
+            k1v = self.forward_dynamics(q, dq, tau)
+            k2q = dq + 0.5*dt*k1v
+            k2v = self.forward_dynamics(q + 0.5*dt*k1q, k2q, tau)
+            k3q = dq + 0.5*dt*k2v
+            k3v = self.forward_dynamics(q + 0.5*dt*k2q, k3q, tau)
+            k4q = dq + dt*k3v
+            k4v = self.forward_dynamics(q + dt*k3q, k4q, tau)
+            q = q + dt * (k1q + 2*k2q + 2*k3q + k4q) / 6
+            dq = dq + dt * (k1v + 2*k2v + 2*k3v + k4v) / 6
+        else:
+            raise ValueError('Unknown integrator {}; expected one of {}.'.format(
+                integrator, INTEGRATORS))
 
         return q, dq
 
@@ -260,3 +792,10 @@ class ThreeInputModel:
 
         q = q + dt * dq
         return q, dq
+
+    def rollout(self, q0, dq0, U, dt):
+        ''' Integrate an entire sequence of velocity inputs U with shape
+            (N, ni), or a batch of sequences with shape (B, N, ni). Limits are
+            applied as in step, with dq0 taking the place of dq_last. Returns
+            the configurations and velocities after each step. '''
+        return bounded_rollout(q0, dq0, U, dt, self.vel_lim, self.acc_lim)
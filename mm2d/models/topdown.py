@@ -1,13 +1,63 @@
-import jax
-import jax.numpy as jnp
+import math
+
 import numpy as np
-from mm2d.util import bound_array
+from mm2d.util import (bound_array, bounded_rollout, ConfigurationCache,
+                       load_kernels, two_link_ik, wrap_to_pi)
+
+# number of configurations for which trigonometric terms are cached
+TRIG_CACHE_SIZE = 8
+
+# joints that rotate link 1 and link 2, respectively: the EE position depends
+# on the joints only through the absolute link angles
+LINK1_JOINTS = np.array([0, 0, 1, 1, 0])
+LINK2_JOINTS = np.array([0, 0, 1, 1, 1])
+
+# fraction of the arm's full extension used when choosing the base position in
+# inverse kinematics, to keep the arm away from the outstretched singularity
+IK_REACH = 0.9
+
+# base length (along its heading) and width
+BL = 1.0
+BW = 0.5
+
+# functions replaced by compiled kernels when a compiled backend is selected
+COMPILED_FUNCTIONS = ('forward', 'jacobian', 'dJdt')
+
+
+class TopDownHolonomicTrig:
+    ''' Sines and cosines of the absolute base and link angles of
+        TopDownHolonomicModel, computed once per configuration. Works on a
+        single q or on a stack of configurations with shape (..., 5). '''
+    def __init__(self, q):
+        self.update(q)
+
+    def update(self, q):
+        ''' Recompute the terms in place for a new configuration. '''
+        if np.ndim(q) == 1:
+            # plain floats are much cheaper than NumPy scalars
+            θb = float(q[2])
+            θb1 = θb + float(q[3])
+            θb12 = θb1 + float(q[4])
+            sin, cos = math.sin, math.cos
+        else:
+            θb = q[..., 2]
+            θb1 = θb + q[..., 3]
+            θb12 = θb1 + q[..., 4]
+            sin, cos = np.sin, np.cos
+
+        self.sb = sin(θb)
+        self.cb = cos(θb)
+        self.s1 = sin(θb1)
+        self.c1 = cos(θb1)
+        self.s12 = sin(θb12)
+        self.c12 = cos(θb12)
 
 
 class TopDownHolonomicModel:
     ''' Holonomic top-down model. Four inputs: base x and y velocity, and two
         arm joint velocities. '''
-    def __init__(self, l1, l2, vel_lim, acc_lim, output_idx=[0,1,2]):
+    def __init__(self, l1, l2, vel_lim, acc_lim, output_idx=[0,1,2], bl=BL,
+                 bw=BW, backend='numpy'):
         self.ni = 5  # number of joints (inputs/DOFs)
 
         # control which outputs are used
@@ -18,22 +68,100 @@ class TopDownHolonomicModel:
         self.l1 = l1
         self.l2 = l2
 
+        # base size
+        self.bl = bl
+        self.bw = bw
+
         self.vel_lim = vel_lim
         self.acc_lim = acc_lim
 
-    def forward(self, q):
-        ''' Forward kinematic transform for the end effector. '''
+        # Evaluation context: trigonometric terms are computed once per
+        # configuration and reused by all kinematic functions queried at the
+        # same q.
+        self.trig = ConfigurationCache(TopDownHolonomicTrig,
+                                       maxsize=TRIG_CACHE_SIZE)
+
+        # scratch buffers for the full forward kinematics and Jacobian, from
+        # which the selected outputs are copied when an out array is given
+        self._p_full = np.empty(3)
+        self._J_full = np.array([[1., 0, 0, 0, 0],
+                                 [0, 1, 0, 0, 0],
+                                 [0, 0, 1, 1, 1]])
+
+        self.set_backend(backend)
+
+    def set_backend(self, backend):
+        ''' Select the implementation of the hot per-configuration functions
+            forward, jacobian and dJdt: 'numpy', or 'numba' for compiled
+            kernels. Falls back to NumPy with a warning if numba is not
+            installed; the backend actually in use is stored in
+            self.backend. '''
+        self._kernels = load_kernels(backend)
+        self.backend = 'numpy' if self._kernels is None else backend
+        self._output_rows = np.array(self.output_idx, dtype=np.int64)
+
+        for name in COMPILED_FUNCTIONS:
+            if self._kernels is None:
+                self.__dict__.pop(name, None)
+            else:
+                setattr(self, name, getattr(self, '_compiled_' + name))
+
+    def __getstate__(self):
+        # the kernel module and the compiled methods bound to this instance
+        # cannot be pickled, so only the backend name is kept and they are
+        # set up again on load
+        state = self.__dict__.copy()
+        state.pop('_kernels', None)
+        for name in COMPILED_FUNCTIONS:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.set_backend(self.backend)
+
+    def _compiled_forward(self, q, out=None):
+        p = np.empty(self.no) if out is None else out
+        self._kernels.topdown_forward(q, self.l1, self.l2, self._output_rows, p)
+        return p
+
+    def _compiled_jacobian(self, q, out=None):
+        J = np.empty((self.no, 5)) if out is None else out
+        self._kernels.topdown_jacobian(q, self.l1, self.l2, self._output_rows, J)
+        return J
+
+    def _compiled_dJdt(self, q, dq):
+        if np.ndim(q) > 1:
+            return TopDownHolonomicModel.dJdt(self, q, dq)
+        dJ = np.empty((self.no, 5))
+        self._kernels.topdown_dJdt(q, dq, self.l1, self.l2, self._output_rows, dJ)
+        return dJ
+
+    def _trig_terms(self, q):
+        ''' Trigonometric terms of a single configuration (cached) or of a
+            stack of configurations (computed directly). '''
+        if np.ndim(q) == 1:
+            return self.trig(q)
+        return TopDownHolonomicTrig(np.asarray(q))
+
+    def forward(self, q, out=None):
+        ''' Forward kinematic transform for the end effector. If out is given,
+            the result is written into it rather than a new array. '''
         xb, yb, θb, θ1, θ2 = q
-        p = np.array([xb + self.l1*np.cos(θb+θ1) + self.l2*np.cos(θb+θ1+θ2),
-                      yb + self.l1*np.sin(θb+θ1) + self.l2*np.sin(θb+θ1+θ2),
-                      θb + θ1 + θ2])
-        return p[self.output_idx]
+        t = self.trig(q)
+        p = self._p_full
+        p[0] = xb + self.l1*t.c1 + self.l2*t.c12
+        p[1] = yb + self.l1*t.s1 + self.l2*t.s12
+        p[2] = θb + θ1 + θ2
+        if out is None:
+            return p[self._output_rows]
+        return np.take(p, self._output_rows, axis=0, out=out, mode='clip')
 
     def forward_f(self, q):
         pb = q[:2]
-        θb = q[2]
+        t = self.trig(q)
         rx = 0.5
-        pf = pb + np.array([rx*np.cos(θb), -rx*np.sin(θb)])
+        pf = pb + np.array([rx*t.cb, -rx*t.sb])
         return pf
 
     def forward_m(self, q):
@@ -42,24 +170,165 @@ class TopDownHolonomicModel:
         pm = 0.5*(pf + pe)
         return pm
 
-    def jacobian(self, q):
-        ''' End effector Jacobian. '''
-        _, _, θb, θ1, θ2 = q
-        dp1dθb = -self.l1*np.sin(θb+θ1)-self.l2*np.sin(θb+θ1+θ2)
-        dp1dθ1 = dp1dθb
-        dp2dθb = self.l1*np.cos(θb+θ1)+self.l2*np.cos(θb+θ1+θ2)
-        dp2dθ1 = dp2dθb
-        J = np.array([
-            [1, 0, dp1dθb, dp1dθ1, -self.l2*np.sin(θb+θ1+θ2)],
-            [0, 1, dp2dθb, dp2dθ1,  self.l2*np.cos(θb+θ1+θ2)],
-            [0, 0, 1, 1, 1]])
-        return J[self.output_idx, :]
+    def jacobian(self, q, out=None):
+        ''' End effector Jacobian. If out is given, the result is written into
+            it rather than a new array. '''
+        t = self.trig(q)
+        J = self._J_full
+        J[0, 4] = -self.l2*t.s12
+        J[0, 2] = J[0, 3] = -self.l1*t.s1 + J[0, 4]
+        J[1, 4] = self.l2*t.c12
+        J[1, 2] = J[1, 3] = self.l1*t.c1 + J[1, 4]
+        if out is None:
+            return J[self._output_rows, :]
+        return np.take(J, self._output_rows, axis=0, out=out, mode='clip')
+
+    def forward_batch(self, Q):
+        ''' Forward kinematics for many configurations at once. Q has shape
+            (..., 5); returns shape (..., no). '''
+        Q = np.asarray(Q)
+        t = self._trig_terms(Q)
+        P = np.empty(Q.shape[:-1] + (3,))
+        P[..., 0] = Q[..., 0] + self.l1*t.c1 + self.l2*t.c12
+        P[..., 1] = Q[..., 1] + self.l1*t.s1 + self.l2*t.s12
+        P[..., 2] = Q[..., 2] + Q[..., 3] + Q[..., 4]
+        return P[..., self.output_idx]
+
+    def jacobian_batch(self, Q):
+        ''' EE Jacobians for many configurations at once. Q has shape
+            (..., 5); returns shape (..., no, 5). '''
+        Q = np.asarray(Q)
+        t = self._trig_terms(Q)
+        J = np.zeros(Q.shape[:-1] + (3, 5))
+        J[..., 0, 0] = 1
+        J[..., 1, 1] = 1
+        J[..., 0, :] += np.multiply.outer(-self.l1*t.s1, LINK1_JOINTS) \
+                + np.multiply.outer(-self.l2*t.s12, LINK2_JOINTS)
+        J[..., 1, :] += np.multiply.outer(self.l1*t.c1, LINK1_JOINTS) \
+                + np.multiply.outer(self.l2*t.c12, LINK2_JOINTS)
+        J[..., 2, :] = LINK2_JOINTS
+        return J[..., self.output_idx, :]
+
+    def hessian(self, q):
+        ''' Second-order kinematics of the EE: H[i, j, k] is the derivative
+            of J[i, j] with respect to q[k], so that dJdt = H @ dq. Also
+            accepts a stack of configurations with shape (..., 5), returning
+            shape (..., no, 5, 5). '''
+        t = self._trig_terms(q)
+        E1 = np.outer(LINK1_JOINTS, LINK1_JOINTS)
+        E2 = np.outer(LINK2_JOINTS, LINK2_JOINTS)
+
+        H = np.zeros(np.shape(t.s1) + (3, 5, 5))
+        H[..., 0, :, :] = -np.multiply.outer(self.l1*t.c1, E1) \
+                - np.multiply.outer(self.l2*t.c12, E2)
+        H[..., 1, :, :] = -np.multiply.outer(self.l1*t.s1, E1) \
+                - np.multiply.outer(self.l2*t.s12, E2)
+        return H[..., self.output_idx, :, :]
+
+    def dJdt(self, q, dq):
+        ''' Derivative of EE Jacobian w.r.t. time, computed from the analytic
+            Hessian. Also accepts stacks of states with shape (..., 5). '''
+        return np.einsum('...ijk,...k->...ij', self.hessian(q), dq)
+
+    def inverse_kinematics(self, P, q_nominal=None, elbow_up=True, reach=IK_REACH):
+        ''' Closed-form inverse kinematics, vectorized over targets P with
+            shape (..., no). The outputs must be [x, y] or [x, y, θ].
+
+            The base pose is redundant. The base heading is taken from
+            q_nominal (zero if not given) and the base position is chosen as
+            close as possible to that of q_nominal such that the arm can reach
+            the target: within reach*(l1+l2) of a position target, or exactly
+            l1 from the wrist of a pose target. Without a nominal
+            configuration the base is placed behind the target along its
+            heading. elbow_up selects the branch with θ2 <= 0 for position
+            targets.
+
+            Returns the configurations, with shape (..., 5), and a mask of the
+            targets that could be reached exactly. '''
+        P = np.asarray(P, dtype=np.float64)
+        p = P[..., :2]
+
+        if list(self.output_idx) == [0, 1]:
+            rmin = abs(self.l1 - self.l2)
+            rmax = reach * (self.l1 + self.l2)
+            target = p
+        elif list(self.output_idx) == [0, 1, 2]:
+            θ = P[..., 2]
+            rmin = rmax = self.l1
+            target = p - self.l2 * np.stack((np.cos(θ), np.sin(θ)), axis=-1)
+        else:
+            raise ValueError('Inverse kinematics requires outputs [x, y] or '
+                             '[x, y, θ], not {}.'.format(self.output_idx))
+
+        if q_nominal is None:
+            θb = np.zeros(P.shape[:-1])
+        else:
+            θb = np.asarray(q_nominal)[..., 2] * np.ones(P.shape[:-1])
+        heading = np.stack((np.cos(θb), np.sin(θb)), axis=-1)
+
+        # move the base radially toward or away from the target until it is
+        # within range
+        if q_nominal is None:
+            v = -heading
+            d = np.full(P.shape[:-1], 0.5 * (rmin + rmax))
+        else:
+            v = np.asarray(q_nominal)[..., :2] - target
+            d = np.linalg.norm(v, axis=-1)
+            v = np.where(d[..., None] > 0, v, -heading)
+            v = v / np.linalg.norm(v, axis=-1)[..., None]
+        pb = target + np.clip(d, rmin, rmax)[..., None] * v
+
+        e = target - pb
+        if list(self.output_idx) == [0, 1]:
+            φ1, θ2, reachable = two_link_ik(e[..., 0], e[..., 1], self.l1,
+                                           self.l2, elbow_up)
+        else:
+            φ1 = np.arctan2(e[..., 1], e[..., 0])
+            θ2 = wrap_to_pi(θ - φ1)
+            reachable = np.ones(P.shape[:-1], dtype=bool)
+        θ1 = wrap_to_pi(φ1 - θb)
+
+        Q = np.concatenate((pb, np.stack((θb, θ1, θ2), axis=-1)), axis=-1)
+        return Q, reachable
+
+    def base_corners_batch(self, Q):
+        ''' Corners of the rectangular base for a whole trajectory of
+            configurations at once. Q has shape (..., 5); returns an array of
+            shape (..., 4, 2), ordered counter-clockwise starting from the back
+            right corner. '''
+        Q = np.asarray(Q)
+        t = self._trig_terms(Q)
+        rx = 0.5 * self.bl
+        ry = 0.5 * self.bw
+        corners = np.array([[-rx, -ry], [rx, -ry], [rx, ry], [-rx, ry]])
+
+        cb = np.asarray(t.cb)[..., None]
+        sb = np.asarray(t.sb)[..., None]
+        ps = np.empty(Q.shape[:-1] + (4, 2))
+        ps[..., 0] = Q[..., None, 0] + cb*corners[:, 0] - sb*corners[:, 1]
+        ps[..., 1] = Q[..., None, 1] + sb*corners[:, 0] + cb*corners[:, 1]
+        return ps
+
+    def arm_points_batch(self, Q):
+        ''' Shoulder (at the base origin), elbow, and end effector positions for
+            a whole trajectory of configurations at once. Q has shape (..., 5);
+            returns an array of shape (..., 3, 2). '''
+        Q = np.asarray(Q)
+        t = self._trig_terms(Q)
+
+        ps = np.empty(Q.shape[:-1] + (3, 2))
+        ps[..., 0, :] = Q[..., :2]
+        ps[..., 1, 0] = Q[..., 0] + self.l1*t.c1
+        ps[..., 1, 1] = Q[..., 1] + self.l1*t.s1
+        ps[..., 2, 0] = ps[..., 1, 0] + self.l2*t.c12
+        ps[..., 2, 1] = ps[..., 1, 1] + self.l2*t.s12
+        return ps
 
     def jacobian_f(self, q):
-        θb = q[2]
+        t = self.trig(q)
         rx = 0.5
-        Jf = np.array([[1, 0, -rx*np.sin(θb), 0, 0],
-                       [0, 1, -rx*np.cos(θb), 0, 0]])
+        Jf = np.array([[1, 0, -rx*t.sb, 0, 0],
+                       [0, 1, -rx*t.cb, 0, 0]])
         return Jf
 
     def jacobian_m(self, q):
@@ -82,3 +351,10 @@ class TopDownHolonomicModel:
 
         q = q + dt * dq
         return q, dq
+
+    def rollout(self, q0, dq0, U, dt):
+        ''' Integrate an entire sequence of velocity inputs U with shape
+            (N, ni), or a batch of sequences with shape (B, N, ni). Limits are
+            applied as in step, with dq0 taking the place of dq_last. Returns
+            the configurations and velocities after each step. '''
+        return bounded_rollout(q0, dq0, U, dt, self.vel_lim, self.acc_lim)
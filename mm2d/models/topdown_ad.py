@@ -2,25 +2,44 @@ import jax
 import jax.numpy as jnp
 import numpy as np
 from functools import partial
+from mm2d import util
 from mm2d.util import bound_array
+from .topdown import BL, BW, TopDownHolonomicModel, TopDownHolonomicTrig
 
 
 class TopDownHolonomicModelAD:
     ''' Holonomic top-down model. Five inputs: base x, y, and yaw velocity, and
         two arm joint velocities. This implementation uses automatic
         differentiation to compute the Jacobian. '''
-    def __init__(self, l1, l2, vel_lim, acc_lim):
+    def __init__(self, l1, l2, vel_lim, acc_lim, bl=BL, bw=BW):
         self.ni = 5  # number of joints (inputs/DOFs)
         self.no = 2
 
         self.l1 = l1
         self.l2 = l2
 
+        # base size
+        self.bl = bl
+        self.bw = bw
+
         self.vel_lim = vel_lim
         self.acc_lim = acc_lim
 
         # Jacobian is calculated automatically using JAX auto-differentiation.
-        self.jacobian = jax.jit(jax.jacobian(partial(self.forward, np=jnp)))
+        forward = partial(self.forward, np=jnp)
+        jacobian = jax.jacobian(forward)
+        self.jacobian = jax.jit(jacobian)
+
+        # Compiled entry points that take and return device arrays. The batch
+        # versions evaluate a whole horizon of configurations with shape
+        # (N, ni) in a single dispatch.
+        self.forward_device = jax.jit(forward)
+        self.forward_batch = jax.jit(jax.vmap(forward))
+        self.jacobian_batch = jax.jit(jax.vmap(jacobian))
+        self.kinematics_batch = jax.jit(
+            lambda Q: (jax.vmap(forward)(Q), jax.vmap(jacobian)(Q)))
+
+        self._rollout = jax.jit(self._rollout_scan)
 
     def forward(self, q, np=np):
         ''' Forward kinematic transform for the end effector. '''
@@ -29,6 +48,21 @@ class TopDownHolonomicModelAD:
                       yb + self.l1*np.sin(θb+θ1) + self.l2*np.sin(θb+θ1+θ2)])
         return p
 
+    def _trig_terms(self, q):
+        return TopDownHolonomicTrig(np.asarray(q))
+
+    # The robot geometry does not need to be differentiated, so the NumPy
+    # implementation of TopDownHolonomicModel is shared.
+    def base_corners_batch(self, Q):
+        ''' Corners of the rectangular base, with shape (..., 4, 2); see
+            TopDownHolonomicModel.base_corners_batch. '''
+        return TopDownHolonomicModel.base_corners_batch(self, Q)
+
+    def arm_points_batch(self, Q):
+        ''' Shoulder, elbow and end effector positions, with shape
+            (..., 3, 2); see TopDownHolonomicModel.arm_points_batch. '''
+        return TopDownHolonomicModel.arm_points_batch(self, Q)
+
     def step(self, q, u, dt, dq_last=None):
         ''' Step forward one timestep. '''
         # velocity limits
@@ -43,3 +77,66 @@ class TopDownHolonomicModelAD:
 
         q = q + dt * dq
         return q, dq
+
+    def _rollout_scan(self, q0, dq0, U, dt):
+        ''' Scan the bounded velocity integration over the time axis of U. '''
+        def step(dq_last, u):
+            dq = jnp.minimum(jnp.maximum(u, -self.vel_lim), self.vel_lim)
+            dq = jnp.minimum(jnp.maximum(dq, -self.acc_lim * dt + dq_last),
+                             self.acc_lim * dt + dq_last)
+            return dq, dq
+
+        _, dqs = jax.lax.scan(step, dq0, jnp.moveaxis(U, -2, 0))
+        dqs = jnp.moveaxis(dqs, 0, -2)
+        qs = q0[..., None, :] + dt * jnp.cumsum(dqs, axis=-2)
+        return qs, dqs
+
+    def rollout(self, q0, dq0, U, dt, device=False):
+        ''' Integrate an entire sequence of velocity inputs U with shape
+            (N, ni), or a batch of sequences with shape (B, N, ni). Limits are
+            applied as in step, with dq0 taking the place of dq_last. Returns
+            the configurations and velocities after each step.
+
+            If device is True, the inputs are not copied to the host first and
+            the results are returned as device arrays, so that they can be
+            passed straight to forward_batch, jacobian_batch or another
+            rollout without any host transfer. '''
+        xp = jnp if device else np
+        U = xp.asarray(U)
+        q0 = xp.asarray(q0)
+        if dq0 is None:
+            # without a previous velocity, the first step is only velocity
+            # limited: seeding the scan with that input makes its
+            # acceleration bound a no-op
+            dq0 = xp.minimum(xp.maximum(U[..., 0, :], -self.vel_lim),
+                             self.vel_lim)
+        dq0 = xp.broadcast_to(dq0, U.shape[:-2] + U.shape[-1:])
+        qs, dqs = self._rollout(q0, dq0, U, dt)
+        if device:
+            return qs, dqs
+        return np.asarray(qs), np.asarray(dqs)
+
+    def warmup(self, horizons=(), batch_sizes=(), dt=0.1):
+        ''' Compile all entry points ahead of time, so that the first control
+            tick does not pay for tracing and compilation. The batched
+            kinematics are compiled for each horizon length in horizons, and
+            rollouts for each horizon, both unbatched and for each batch size.
+            Combine with util.enable_compilation_cache to reuse the compiled
+            code across processes. Returns the time spent compiling each
+            function, in seconds. '''
+        q = np.zeros(self.ni)
+        times = {
+            'forward': util.warmup(self.forward_device, q),
+            'jacobian': util.warmup(self.jacobian, q),
+        }
+        for N in horizons:
+            Q = np.zeros((N, self.ni))
+            times['forward_batch', N] = util.warmup(self.forward_batch, Q)
+            times['jacobian_batch', N] = util.warmup(self.jacobian_batch, Q)
+            times['kinematics_batch', N] = util.warmup(self.kinematics_batch, Q)
+            for B in (None,) + tuple(batch_sizes):
+                shape = (N, self.ni) if B is None else (B, N, self.ni)
+                U = np.zeros(shape)
+                dq0 = np.zeros(shape[:-2] + (self.ni,))
+                times['rollout', B, N] = util.warmup(self._rollout, q, dq0, U, dt)
+        return times
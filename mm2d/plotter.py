@@ -1,7 +1,9 @@
 import numpy as np
-import matplotlib.pyplot as plt
-from mm2d.util import rotation_matrix
-from matplotlib.animation import FFMpegWriter
+from mm2d.util import rotation_matrix, LazyModule
+
+# matplotlib is only imported once something is actually drawn
+plt = LazyModule('matplotlib.pyplot')
+animation = LazyModule('matplotlib.animation')
 
 
 class PointRenderer:
@@ -76,44 +78,26 @@ class TrajectoryRenderer(object):
 
 
 class TopDownHolonomicRenderer:
-    def __init__(self, model, q0, length=1, width=0.5, render_path=True, render_collision=False):
+    def __init__(self, model, q0, render_path=True, render_collision=False):
         self.model = model
         self.q = q0
         self.render_path = render_path
         self.render_collision = render_collision
         self.xs = []
         self.ys = []
-        self.length = length
-        self.width = width
-        self.base_r = np.sqrt(0.25*width**2 + 0.25*length**2)
+        self.base_r = np.sqrt(0.25*model.bw**2 + 0.25*model.bl**2)
 
     def calc_base_points(self, q):
-        ''' Generate an array of points representing the base of the robot. '''
-        pb = q[:2]
-        θb = q[2]
-        rx = self.length * 0.5
-        ry = self.width * 0.5
-
-        R = np.array([[np.cos(θb), -np.sin(θb)],
-                      [np.sin(θb),  np.cos(θb)]])
-        p = pb + R.dot([[-rx, rx, rx, -rx, -rx],
-                        [-ry, -ry, ry, ry, -ry]]).T
-
+        ''' Generate an array of points representing the base of the robot,
+            closed so that it can be drawn as a line. '''
+        p = self.model.base_corners_batch(q)
+        p = np.append(p, p[:1], axis=0)
         return p[:, 0], p[:, 1]
 
     def calc_arm_points(self, q):
         ''' Generate an array of points representing the arm of the robot. '''
-        xb, yb, θb, θ1, θ2 = q
-        x1 = xb + self.model.l1*np.cos(θb+θ1)
-        x2 = x1 + self.model.l2*np.cos(θb+θ1+θ2)
-
-        y1 = yb + self.model.l1*np.sin(θb+θ1)
-        y2 = y1 + self.model.l2*np.sin(θb+θ1+θ2)
-
-        x = np.array([xb, x1, x2])
-        y = np.array([yb, y1, y2])
-
-        return x, y
+        p = self.model.arm_points_batch(q)
+        return p[:, 0], p[:, 1]
 
     def set_state(self, q):
         self.q = q
@@ -244,7 +228,7 @@ class Video:
     ''' Writer for a video recording of the real time plot. '''
     def __init__(self, name='recording.mp4', fps=10):
         self.name = name
-        self.writer = FFMpegWriter(fps=fps)
+        self.writer = animation.FFMpegWriter(fps=fps)
 
     def setup(self, fig):
         self.writer.setup(fig, self.name)
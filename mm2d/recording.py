@@ -0,0 +1,209 @@
+# Recording and deterministic replay of closed-loop runs. A run is recorded as
+# columns of per-step arrays (states, references, controller arguments and
+# outputs, solve times) in a single compressed .npz file. Replaying re-runs
+# only the controller on the recorded arguments, so that changes to a
+# controller can be checked for both identical outputs and latency without
+# the simulation, plotting or noise of the original run.
+import json
+import time
+
+import numpy as np
+
+
+# prefix of the columns holding the positional arguments of controller.solve
+ARG_PREFIX = 'arg'
+
+# columns written by RecordedController
+OUTPUT_COLUMN = 'u'
+SOLVE_TIME_COLUMN = 'solve_time'
+
+
+class Recording:
+    ''' Columns of a recorded run. Each column is an array whose first axis is
+        the step index; metadata is a dict of JSON-serializable values. '''
+    def __init__(self, columns, metadata=None):
+        self.columns = columns
+        self.metadata = {} if metadata is None else metadata
+
+    @property
+    def num_steps(self):
+        return max((len(c) for c in self.columns.values()), default=0)
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def solve_args(self, k):
+        ''' Positional arguments of the controller's solve at step k. '''
+        n = self.metadata.get('num_args', 0)
+        return [self.columns[ARG_PREFIX + str(i)][k] for i in range(n)]
+
+    def save(self, path):
+        ''' Save to a compressed .npz file with one array per column. '''
+        np.savez_compressed(path, __metadata__=json.dumps(self.metadata),
+                            **self.columns)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            metadata = json.loads(str(data['__metadata__']))
+            columns = {name: data[name] for name in data.files
+                       if name != '__metadata__'}
+        return cls(columns, metadata)
+
+
+class Recorder:
+    ''' Per-step log of a run of up to num_steps steps. The array of each
+        column is allocated the first time the column is recorded, from the
+        shape and type of that value, so recording a step only copies values
+        into place. '''
+    def __init__(self, num_steps, metadata=None):
+        self.num_steps = num_steps
+        self.metadata = {} if metadata is None else dict(metadata)
+        self.columns = {}
+
+        # one more than the last step recorded
+        self.length = 0
+
+    def record(self, k, **values):
+        ''' Record values, given by column name, at step k. Each column must
+            have the same shape at every step. '''
+        for name, value in values.items():
+            column = self.columns.get(name)
+            if column is None:
+                if value is None:
+                    raise ValueError('Cannot record None in column {}.'.format(name))
+                value = np.asarray(value)
+                column = np.zeros((self.num_steps,) + value.shape, dtype=value.dtype)
+                self.columns[name] = column
+            column[k] = value
+        self.length = max(self.length, k + 1)
+
+    def recording(self):
+        ''' The steps recorded so far, as a Recording. '''
+        columns = {name: column[:self.length]
+                   for name, column in self.columns.items()}
+        return Recording(columns, self.metadata)
+
+    def save(self, path):
+        self.recording().save(path)
+
+
+class RecordedController:
+    ''' Wrapper around a controller that records the positional arguments,
+        output and wall time of each call to solve, one step per call, in a
+        Recorder. Arguments must be arrays or numbers with the same shape at
+        every step; keyword arguments are not supported. Other attributes are
+        those of the wrapped controller. '''
+    def __init__(self, controller, recorder):
+        self.controller = controller
+        self.recorder = recorder
+        self.recorder.metadata.setdefault('controller', type(controller).__name__)
+        self.k = 0
+
+    def __getattr__(self, name):
+        return getattr(self.controller, name)
+
+    def solve(self, *args):
+        t0 = time.perf_counter()
+        u = self.controller.solve(*args)
+        solve_time = time.perf_counter() - t0
+
+        values = {ARG_PREFIX + str(i): arg for i, arg in enumerate(args)}
+        values[OUTPUT_COLUMN] = u
+        values[SOLVE_TIME_COLUMN] = solve_time
+        self.recorder.metadata['num_args'] = len(args)
+        self.recorder.record(self.k, **values)
+        self.k += 1
+        return u
+
+
+class ReplayReport:
+    ''' Comparison of a replay with the recording it replayed. solve_times
+        are the times of the first pass over the recording, which are measured
+        the same way as the recorded ones and so are the ones compared with
+        them. best_solve_times, if given, are the fastest time of each step
+        over several passes, which are less noisy but biased low. '''
+    def __init__(self, us, solve_times, recorded_us, recorded_solve_times,
+                 best_solve_times=None):
+        self.us = us
+        self.solve_times = solve_times
+        self.recorded_us = recorded_us
+        self.recorded_solve_times = recorded_solve_times
+        self.best_solve_times = best_solve_times
+
+    @property
+    def max_deviation(self):
+        ''' Largest absolute difference between the replayed and recorded
+            outputs. '''
+        if len(self.us) == 0:
+            return 0.0
+        return np.max(np.abs(self.us - self.recorded_us))
+
+    def matches(self, atol=1e-9):
+        return self.max_deviation <= atol
+
+    @staticmethod
+    def _percentiles(times):
+        return np.percentile(times, [50, 95, 100]) * 1e3
+
+    def __str__(self):
+        lines = ['{} steps replayed, max output deviation {:.3g}'.format(
+            len(self.us), self.max_deviation)]
+        lines.append('{:>10} {:>10} {:>10} {:>10}'.format(
+            'ms', 'median', 'p95', 'max'))
+        rows = [('recorded', self.recorded_solve_times),
+                ('replayed', self.solve_times)]
+        if self.best_solve_times is not None:
+            rows.append(('best of N', self.best_solve_times))
+        for label, times in rows:
+            lines.append('{:>10} {:>10.3f} {:>10.3f} {:>10.3f}'.format(
+                label, *self._percentiles(times)))
+        speedup = np.median(self.recorded_solve_times) / np.median(self.solve_times)
+        lines.append('median speedup {:.2f}x (recorded vs replayed)'.format(speedup))
+        return '\n'.join(lines)
+
+
+def replay(recording, controller, repeat=1, make_controller=None):
+    ''' Re-run controller.solve on the arguments recorded at every step of a
+        recording made with RecordedController, in order. Each solve is
+        timed once, like the recorded ones, for the comparison.
+
+        If repeat > 1, the whole recording is replayed repeat times in total
+        and the fastest time of each step is also kept, which reduces timing
+        noise. Each extra pass uses a new controller from make_controller(),
+        which must start in the same state as controller did, so that
+        stateful controllers (integrators, warm starts) see the same history
+        in every pass. Returns a ReplayReport. '''
+    if repeat > 1 and make_controller is None:
+        raise ValueError('make_controller is required when repeat > 1.')
+
+    recorded_us = recording[OUTPUT_COLUMN]
+    n = len(recorded_us)
+    us = np.zeros_like(recorded_us)
+    solve_times = _replay_pass(recording, controller, us)
+
+    best_solve_times = None
+    if repeat > 1:
+        best_solve_times = np.copy(solve_times)
+        u_pass = np.zeros_like(recorded_us)
+        for _ in range(repeat - 1):
+            times = _replay_pass(recording, make_controller(), u_pass)
+            np.minimum(best_solve_times, times, out=best_solve_times)
+
+    return ReplayReport(us, solve_times, recorded_us,
+                        recording[SOLVE_TIME_COLUMN], best_solve_times)
+
+
+def _replay_pass(recording, controller, us):
+    ''' Solve every recorded step in order, writing the outputs into us.
+        Returns the time of each solve. '''
+    solve_times = np.zeros(len(us))
+    for k in range(len(us)):
+        args = recording.solve_args(k)
+        t0 = time.perf_counter()
+        us[k] = controller.solve(*args)
+        solve_times[k] = time.perf_counter() - t0
+    return solve_times
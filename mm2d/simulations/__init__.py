@@ -1 +1,16 @@
-from .pymunk import PymunkSimulationVelocity, PymunkSimulationTorque
+# Simulations for mm2d. Backends with heavy dependencies are only imported
+# when they are first requested.
+from .batch import BatchSimulationTorque
+from .headless import run_headless, ThroughputReport
+from .runner import run_closed_loop, Results
+
+
+def __getattr__(name):
+    if name in ('PymunkSimulationVelocity', 'PymunkSimulationTorque',
+                'PymunkSimulationTopDown'):
+        from . import pymunk
+        return getattr(pymunk, name)
+    if name == 'run_episodes':
+        from .farm import run_episodes
+        return run_episodes
+    raise AttributeError('module {} has no attribute {}'.format(__name__, name))
@@ -0,0 +1,80 @@
+import numpy as np
+
+
+class BatchSimulationTorque:
+    """Contact-free simulation of a batch of torque-controlled robots, stepped
+    together by integrating the model's analytic dynamics.
+
+    This exposes the same add_robot/command_torque/step/reset surface as
+    PymunkSimulationTorque, so scripts can switch between them by changing
+    the constructor. There are no contacts, joint constraints or other bodies:
+    the robot is exactly the rigid-body model, which is much faster than
+    pymunk when nothing else needs to be simulated.
+    """
+
+    def __init__(self, dt, gravity=-9.8, iterations=None, substeps=1,
+                 integrator='euler'):
+        """Initialize the simulation.
+
+        Arguments:
+            dt: control period, i.e. the time advanced by each call to step
+                (seconds)
+            gravity: vertical acceleration due to gravity (m/s**2); must match
+                the model's gravity, which is what is actually used
+            iterations: accepted for compatibility with the pymunk
+                simulations; there is no constraint solver to iterate
+            substeps: number of integration steps per control period
+            integrator: fixed-step integrator, one of
+                mm2d.models.side.INTEGRATORS. The default is explicit Euler,
+                the default of ThreeInputModel.command_torque, so a robot
+                stepped here follows the same trajectory as one stepped with
+                the model. It drifts in energy; use 'rk4' when energy must be
+                conserved over long runs
+        """
+        self.dt = dt
+        self.gravity = gravity
+        self.substeps = substeps
+        self.physics_dt = dt / substeps
+        self.integrator = integrator
+
+    def add_robot(self, model, q0):
+        """Add the robots, all described by model. q0 is either a single
+        configuration or a batch of configurations with shape (B, 3), one for
+        each robot to simulate."""
+        if self.gravity is not None and not np.isclose(-self.gravity, model.gravity):
+            raise ValueError('Simulation gravity {} does not match the model '
+                             'gravity {}.'.format(self.gravity, model.gravity))
+        self.model = model
+        self.reset(q0)
+
+    def reset(self, q0, dq0=None):
+        """Start a new episode from configuration(s) q0 with joint velocities
+        dq0 (zero by default). Commanded torques are reset to zero."""
+        self.q = np.array(q0, dtype=np.float64)
+        self.dq = np.zeros_like(self.q) if dq0 is None \
+                else np.array(np.broadcast_to(dq0, self.q.shape), dtype=np.float64)
+        self.tau = np.zeros_like(self.q)
+        return self.q, self.dq
+
+    def snapshot(self):
+        """Copy of the current state and commanded torques."""
+        return np.copy(self.q), np.copy(self.dq), np.copy(self.tau)
+
+    def restore(self, snapshot):
+        """Return to a state saved by snapshot."""
+        q, dq, tau = snapshot
+        self.q, self.dq, self.tau = np.copy(q), np.copy(dq), np.copy(tau)
+
+    def command_torque(self, tau):
+        """Command joint torques, either one set for all robots or a batch
+        with shape (B, 3). They are held constant over the next step."""
+        self.tau = tau
+
+    def step(self):
+        """Step all robots forward one control period."""
+        q, dq = self.q, self.dq
+        for _ in range(self.substeps):
+            q, dq = self.model.command_torque(q, dq, self.tau, self.physics_dt,
+                                              integrator=self.integrator)
+        self.q, self.dq = q, dq
+        return self.q, self.dq
@@ -0,0 +1,86 @@
+# Farm of independent simulation episodes run in parallel worker processes,
+# e.g. for Monte Carlo robustness sweeps. Each worker builds its own
+# simulation and controller per episode and streams the per-step states into
+# arrays in shared memory, so that no states have to be pickled back to the
+# parent process.
+import multiprocessing as mp
+
+import numpy as np
+
+
+# shared state of each worker process, set by _init_worker
+_worker = {}
+
+
+def _init_worker(make_episode, num_steps, ni, q_buf, dq_buf):
+    _worker['make_episode'] = make_episode
+    _worker['num_steps'] = num_steps
+    _worker['qs'] = np.frombuffer(q_buf).reshape((-1, num_steps + 1, ni))
+    _worker['dqs'] = np.frombuffer(dq_buf).reshape((-1, num_steps + 1, ni))
+
+
+def _run_episode(args):
+    ''' Run a single episode in a worker, writing its states into the shared
+        arrays. '''
+    index, seed_seq = args
+    rng = np.random.default_rng(seed_seq)
+    sim, policy = _worker['make_episode'](index, rng)
+
+    qs = _worker['qs'][index]
+    dqs = _worker['dqs'][index]
+    q, dq = sim.q, sim.dq
+    qs[0], dqs[0] = q, dq
+    for k in range(_worker['num_steps']):
+        policy(k, q, dq)
+        q, dq = sim.step()
+        qs[k+1], dqs[k+1] = q, dq
+    return index
+
+
+def run_episodes(make_episode, num_episodes, num_steps, ni, num_workers=None,
+                 seed=None, context=None):
+    ''' Run num_episodes independent episodes of num_steps control periods
+        across num_workers processes (default: one per CPU).
+
+        make_episode(index, rng) builds the episode: it returns the
+        simulation, with its robot already added, and a policy. Before each
+        step, policy(k, q, dq) is called with the step index and the current
+        state and should command the simulation (e.g. with command_torque);
+        it typically wraps a controller instance created for the episode.
+        Each episode gets its own random generator, seeded from a
+        SeedSequence spawned from seed, so results are reproducible
+        regardless of how episodes are scheduled on workers.
+
+        With the 'fork' start method make_episode may be any callable; with
+        'spawn' it must be picklable (a module-level function). context
+        selects the start method, by default that of the platform.
+        num_workers=1 runs all episodes serially in this process.
+
+        Returns the joint positions and velocities of every episode, each
+        with shape (num_episodes, num_steps + 1, ni). '''
+    ctx = mp.get_context(context)
+    size = num_episodes * (num_steps + 1) * ni
+    q_buf = ctx.RawArray('d', size)
+    dq_buf = ctx.RawArray('d', size)
+
+    seed_seqs = np.random.SeedSequence(seed).spawn(num_episodes)
+    tasks = list(enumerate(seed_seqs))
+    initargs = (make_episode, num_steps, ni, q_buf, dq_buf)
+
+    if num_workers == 1:
+        _init_worker(*initargs)
+        try:
+            for task in tasks:
+                _run_episode(task)
+        finally:
+            _worker.clear()
+    else:
+        with ctx.Pool(num_workers, initializer=_init_worker,
+                      initargs=initargs) as pool:
+            # results only signal completion, so order does not matter
+            for _ in pool.imap_unordered(_run_episode, tasks):
+                pass
+
+    qs = np.frombuffer(q_buf).reshape((num_episodes, num_steps + 1, ni))
+    dqs = np.frombuffer(dq_buf).reshape((num_episodes, num_steps + 1, ni))
+    return qs, dqs
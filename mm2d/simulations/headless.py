@@ -0,0 +1,91 @@
+# Headless (faster than real time) running of simulations: no rendering and
+# no matplotlib, just the controller and the physics, with a report of the
+# throughput of each.
+import time
+
+import numpy as np
+
+
+class ThroughputReport:
+    """Timing of a headless run, split between the controller and the
+    physics. For a batch simulation, each physics step advances batch_size
+    robots."""
+    def __init__(self, num_steps, substeps, dt, solve_time, step_time,
+                 wall_time, batch_size=1):
+        self.num_steps = num_steps      # control periods simulated
+        self.substeps = substeps        # physics steps per control period
+        self.batch_size = batch_size    # robots simulated together
+        self.dt = dt                    # control period (s)
+        self.solve_time = solve_time    # wall time in the controller (s)
+        self.step_time = step_time      # wall time in the physics (s)
+        self.wall_time = wall_time      # total wall time (s)
+
+    @property
+    def physics_steps_per_second(self):
+        return self.num_steps * self.substeps / self.step_time
+
+    @property
+    def robot_steps_per_second(self):
+        """Physics steps per second summed over the robots of the batch."""
+        return self.physics_steps_per_second * self.batch_size
+
+    @property
+    def solves_per_second(self):
+        return self.num_steps / self.solve_time
+
+    @property
+    def real_time_factor(self):
+        """Simulated time per unit wall time."""
+        return self.num_steps * self.dt / self.wall_time
+
+    def __str__(self):
+        if self.batch_size > 1:
+            physics = '{:.0f} physics steps/s of {} robots ({:.0f} robot ' \
+                    'steps/s)'.format(self.physics_steps_per_second,
+                                      self.batch_size,
+                                      self.robot_steps_per_second)
+        else:
+            physics = '{:.0f} physics steps/s'.format(
+                self.physics_steps_per_second)
+        return ('{} control steps ({:.2f} s simulated) in {:.2f} s: '
+                '{}, {:.0f} controller solves/s, {:.1f}x real time'.format(
+                    self.num_steps, self.num_steps * self.dt, self.wall_time,
+                    physics, self.solves_per_second, self.real_time_factor))
+
+
+def run_headless(sim, policy, num_steps):
+    """Run sim for num_steps control periods as fast as possible.
+
+    Before each step, policy(k, q, dq) is called with the step index and the
+    current state and should command the simulation (e.g. with
+    command_torque). Any simulation with q, dq, dt and step works, including
+    the pymunk and batch simulations.
+
+    Returns the joint positions and velocities at each control boundary, each
+    with shape (num_steps + 1, ...) followed by the shape of the state, and a
+    ThroughputReport. A state with more than one dimension is taken to be a
+    batch of robots along its first axis.
+    """
+    q, dq = sim.q, sim.dq
+    qs = np.zeros((num_steps + 1,) + np.shape(q))
+    dqs = np.zeros((num_steps + 1,) + np.shape(dq))
+    qs[0], dqs[0] = q, dq
+
+    solve_time = step_time = 0
+    t_start = time.perf_counter()
+    for k in range(num_steps):
+        t0 = time.perf_counter()
+        policy(k, q, dq)
+        t1 = time.perf_counter()
+        q, dq = sim.step()
+        t2 = time.perf_counter()
+
+        solve_time += t1 - t0
+        step_time += t2 - t1
+        qs[k+1], dqs[k+1] = q, dq
+    wall_time = time.perf_counter() - t_start
+
+    batch_size = np.shape(q)[0] if np.ndim(q) > 1 else 1
+    report = ThroughputReport(num_steps, getattr(sim, 'substeps', 1), sim.dt,
+                              solve_time, step_time, wall_time, batch_size)
+    return qs, dqs, report
@@ -1,25 +1,209 @@
+import copy
+import pickle
+
 import numpy as np
 import pymunk
+import pymunk.batch
 from mm2d.util import bound_array
 
 
+class PymunkSnapshot:
+    """State of a pymunk simulation at one instant, as saved by
+    PymunkSimulationBase.snapshot.
+
+    Bodies and motors are stored by their order in the space rather than by
+    reference, so a snapshot can also be restored into a clone of the
+    simulation it was taken from.
+    """
+    def __init__(self, bodies, motor_rates, q, dq, inputs, physics_steps=0):
+        self.bodies = bodies            # rows [x, y, angle, vx, vy, ω]
+        self.motor_rates = motor_rates
+        self.q = q
+        self.dq = dq
+        self.inputs = inputs            # commanded inputs, if any
+        self.physics_steps = physics_steps
+
+
+# collision type of the end effector fingers, used to log their contacts
+FINGER_COLLISION_TYPE = 1
+
+# default number of contact events kept by a ContactLogger
+CONTACT_LOG_CAPACITY = 10000
+
+# body fields read by PymunkSimulationBase.read_bodies: after the body id,
+# each body has a row [x, y, angle, vx, vy, ω] of floats
+BODY_STATE_FIELDS = (pymunk.batch.BodyFields.BODY_ID
+                     | pymunk.batch.BodyFields.POSITION
+                     | pymunk.batch.BodyFields.ANGLE
+                     | pymunk.batch.BodyFields.VELOCITY
+                     | pymunk.batch.BodyFields.ANGULAR_VELOCITY)
+
+
+class ContactLogger:
+    """Log of the contacts between the end effector fingers and other bodies,
+    written by a pymunk collision handler into preallocated ring buffers.
+
+    One event is recorded per finger contact per physics step, after pymunk
+    has solved for its impulse. Once capacity events have been recorded, the
+    oldest events are overwritten. Nothing is allocated per event beyond the
+    arbiter data pymunk itself creates, so logging can stay on during long
+    runs. Use arrays to export the recorded events after the run.
+    """
+    def __init__(self, capacity=CONTACT_LOG_CAPACITY):
+        self.capacity = capacity
+
+        # each event is written as one row of integers (step, finger, body)
+        # and one of floats (point, normal, impulse), which is much cheaper
+        # than writing each field separately
+        self._ints = np.zeros((capacity, 3), dtype=np.int64)
+        self._floats = np.zeros((capacity, 6))
+
+        # total number of events recorded, including overwritten ones
+        self.count = 0
+
+        # index of each body in the space, looked up the first time it is
+        # touched, and the number of bodies in the space when they were
+        self._body_ids = {}
+        self._num_bodies = 0
+
+    def clear(self):
+        """Discard all recorded events."""
+        self.count = 0
+
+    def _body_id(self, body, space):
+        # adding or removing bodies can change the index of any of them
+        num_bodies = len(space.bodies)
+        if num_bodies != self._num_bodies:
+            self._body_ids.clear()
+            self._num_bodies = num_bodies
+
+        body_id = self._body_ids.get(body)
+        if body_id is None:
+            # static bodies are not in space.bodies
+            bodies = list(space.bodies)
+            body_id = bodies.index(body) if body in bodies else -1
+            self._body_ids[body] = body_id
+        return body_id
+
+    def _post_solve(self, arbiter, space, sim):
+        finger, other = arbiter.shapes
+        points = arbiter.contact_point_set.points
+        if not points:
+            return
+
+        # a finger is a circle, so it touches at most at one point
+        point = points[0].point_a
+        normal = arbiter.normal
+        impulse = arbiter.total_impulse
+
+        i = self.count % self.capacity
+        self._ints[i] = (sim.physics_steps, sim.fingers.index(finger),
+                         self._body_id(other.body, space))
+        self._floats[i] = (point.x, point.y, normal.x, normal.y,
+                           impulse.x, impulse.y)
+        self.count += 1
+
+    def arrays(self, dt=None):
+        """Recorded events in chronological order, as a dict of arrays:
+
+            step:     index of the physics step of the event
+            finger:   index of the finger in contact (0 or 1)
+            body:     index of the other body in space.bodies, or -1 for
+                      static bodies such as the ground
+            point:    contact point on the finger (world frame)
+            normal:   contact normal, pointing from the finger to the body
+            impulse:  total impulse applied to the finger over the step; the
+                      body receives the opposite impulse
+            normal_impulse: magnitude of the normal part of the impulse,
+                      which is non-negative since contacts only push
+
+        If the physics timestep dt is given, the time t at the end of the step
+        of each event is included as well. Divide the impulses by dt to get
+        the average contact forces over each step.
+        """
+        n = min(self.count, self.capacity)
+        start = self.count % self.capacity if self.count > self.capacity else 0
+        idx = (start + np.arange(n)) % self.capacity
+
+        ints = self._ints[idx]
+        floats = self._floats[idx]
+        data = {'step': ints[:, 0], 'finger': ints[:, 1], 'body': ints[:, 2],
+                'point': floats[:, 0:2], 'normal': floats[:, 2:4],
+                'impulse': floats[:, 4:6]}
+        data['normal_impulse'] = -np.sum(data['impulse'] * data['normal'], axis=1)
+        if dt is not None:
+            data['t'] = (data['step'] + 1) * dt
+        return data
+
+
 class PymunkSimulationBase:
     """Base class for pymunk-based physics simulation."""
 
-    def __init__(self, dt, gravity=-9.8, iterations=10):
+    def __init__(self, dt, gravity=-9.8, iterations=10, substeps=1):
         """Initialize the pymunk simulation.
 
         Arguments:
-            dt: simulation timestep (seconds)
+            dt: control period, i.e. the time advanced by each call to step
+                (seconds)
             gravity: vertical acceleration due to gravity (m/s**2)
             iterations: number of iterations the solver should perform each
                 step; the Pymunk default is 10
+            substeps: number of physics steps per control period, so the
+                physics timestep is dt / substeps. Inputs are held constant
+                over the control period and the state is only read at its
+                end.
         """
         self.dt = dt
+        self.substeps = substeps
+        self.physics_dt = dt / substeps
         self.space = pymunk.Space()
         self.space.gravity = (0, gravity)
         self.space.iterations = iterations
 
+        # number of physics steps taken so far, used to time stamp contacts
+        self.physics_steps = 0
+        self.contact_logger = None
+
+        # state of every body in the space, filled by read_bodies
+        self.body_states = np.zeros((0, 6))
+        self._body_ids = np.zeros(0, dtype=np.uintp)
+        self._body_rows = {}
+        self._batch_buffer = None
+
+    def __getstate__(self):
+        # the batch buffer wraps memory allocated by pymunk, so it cannot be
+        # pickled; clones create their own when first needed
+        state = self.__dict__.copy()
+        state['_batch_buffer'] = None
+        return state
+
+    def read_bodies(self):
+        """Read the state of every body in the space in one batch into the
+        array body_states, which has a row [x, y, angle, vx, vy, ω] per body.
+        Use body_row to find the row of a particular body. The array is only
+        reallocated when bodies are added or removed, so views of it stay
+        valid from step to step."""
+        if self._batch_buffer is None:
+            self._batch_buffer = pymunk.batch.Buffer()
+        buf = self._batch_buffer
+        buf.clear()
+        pymunk.batch.get_space_bodies(self.space, BODY_STATE_FIELDS, buf)
+
+        ids = np.frombuffer(buf.int_buf(), dtype=np.uintp)
+        states = np.frombuffer(buf.float_buf()).reshape((-1, 6))
+        if not np.array_equal(ids, self._body_ids):
+            # the bodies or their order changed (or this is a clone, in
+            # which the bodies have new ids)
+            self._body_ids = ids.copy()
+            self._body_rows = {body_id: row for row, body_id in enumerate(ids)}
+            self.body_states = np.empty_like(states)
+        self.body_states[:] = states
+        return self.body_states
+
+    def body_row(self, body):
+        """Row of body in body_states."""
+        return self._body_rows[body.id]
+
     def add_ground(self, y):
         ground = pymunk.Segment(self.space.static_body, (-10, y), (10, y),
                                 0.01)
@@ -28,50 +212,28 @@ class PymunkSimulationBase:
         ground.friction = 0.5
 
     def add_robot(self, model, q0, dynamic=False):
-        self.q = np.copy(q0)
-        self.dq = np.zeros(3)
-
         # ground
         self.add_ground(-model.bh)
 
-        # base
+        # base, with its origin at the bottom of the arm's shoulder joint
         base_type = pymunk.Body.DYNAMIC if dynamic else pymunk.Body.KINEMATIC
         base_body = pymunk.Body(body_type=base_type)
-        bx, by = model.base_corners(q0)
-        by += 0.5*model.bh
-        base = pymunk.Poly(
-                base_body,
-                [(x, y) for x, y in zip(bx, by)],
-                pymunk.Transform(tx=0, ty=-0.5*model.bh))
+        bx, by = model.base_corners(np.zeros(3))
+        base = pymunk.Poly(base_body, [(x, y) for x, y in zip(bx, by)])
         base.friction = 0
         # add the mass manually but let pymunk figure out the moment
         base.mass = model.mb
         self.space.add(base.body, base)
 
         # arm link 1
-        ax, ay = model.arm_points(q0)
-        dx1 = 0.5*model.l1*np.cos(q0[1])
-        dy1 = 0.5*model.l1*np.sin(q0[1])
         link1_body = pymunk.Body(mass=model.m1, moment=model.I1)
-        link1_body.position = (ax[0] + dx1, ay[0] + dy1)
-        link1_body.angle = q0[1]
         link1 = pymunk.Segment(link1_body, (-0.5*model.l1, 0),
                                (0.5*model.l1, 0), radius=0.05)
         link1.friction = 0.25
         self.space.add(link1.body, link1)
 
-        # arm joint 1
-        joint1 = pymunk.PinJoint(base.body, link1.body, (0, 0),
-                                 (-0.5*model.l1, 0))
-        joint1.collide_bodies = False
-        self.space.add(joint1)
-
         # arm link 2
-        dx2 = 0.5*model.l2*np.cos(q0[1]+q0[2])
-        dy2 = 0.5*model.l2*np.sin(q0[1]+q0[2])
         link2_body = pymunk.Body(mass=model.m2, moment=model.I2)
-        link2_body.position = (ax[1] + dx2, ay[1] + dy2)
-        link2_body.angle = q0[1] + q0[2]
         link2 = pymunk.Segment(link2_body, (-0.5*model.l2, 0),
                                (0.5*model.l2, 0), radius=0.05)
         link2.friction = 0.25
@@ -84,6 +246,22 @@ class PymunkSimulationBase:
         self.space.add(finger1, finger2)
         finger1.friction = 0.75
         finger2.friction = 0.75
+        finger1.collision_type = FINGER_COLLISION_TYPE
+        finger2.collision_type = FINGER_COLLISION_TYPE
+        self.fingers = [finger1, finger2]
+
+        self.model = model
+        self.links = [base.body, link1.body, link2.body]
+
+        # the bodies must be in place before the joints are created, since
+        # pin joints keep the distance between their anchors at creation
+        self._set_robot_state(q0, np.zeros(3))
+
+        # arm joint 1
+        joint1 = pymunk.PinJoint(base.body, link1.body, (model.lx, model.ly),
+                                 (-0.5*model.l1, 0))
+        joint1.collide_bodies = False
+        self.space.add(joint1)
 
         # arm joint 2
         joint2 = pymunk.PinJoint(link1.body, link2.body, (0.5*model.l1, 0),
@@ -91,8 +269,98 @@ class PymunkSimulationBase:
         joint2.collide_bodies = False
         self.space.add(joint2)
 
-        self.model = model
-        self.links = [base.body, link1.body, link2.body]
+    def log_contacts(self, capacity=CONTACT_LOG_CAPACITY):
+        """Start logging the contacts of the end effector fingers with other
+        bodies into a ContactLogger holding up to capacity events, which is
+        returned and also available as contact_logger. Must be called after
+        add_robot."""
+        self.contact_logger = ContactLogger(capacity)
+        self.space.on_collision(FINGER_COLLISION_TYPE, None,
+                                post_solve=self.contact_logger._post_solve,
+                                data=self)
+        return self.contact_logger
+
+    def contacts(self):
+        """Arrays of the logged contact events; see ContactLogger.arrays."""
+        if self.contact_logger is None:
+            raise ValueError('Contact logging is not enabled; call '
+                             'log_contacts first.')
+        return self.contact_logger.arrays(self.physics_dt)
+
+    def _set_robot_state(self, q, dq):
+        """Place the robot's bodies at configuration q moving with joint
+        velocities dq, and clear their forces."""
+        model = self.model
+        xb, θ1, θ2 = q
+        dxb, dθ1, dθ2 = dq
+        θ12 = θ1 + θ2
+        dθ12 = dθ1 + dθ2
+
+        # unit vectors along and normal to each link
+        e1 = np.array([np.cos(θ1), np.sin(θ1)])
+        n1 = np.array([-e1[1], e1[0]])
+        e12 = np.array([np.cos(θ12), np.sin(θ12)])
+        n12 = np.array([-e12[1], e12[0]])
+
+        shoulder = np.array([xb + model.lx, model.ly])
+        elbow = shoulder + model.l1 * e1
+        vb = np.array([dxb, 0])
+        v_elbow = vb + model.l1 * dθ1 * n1
+
+        poses = [(np.array([xb, 0]), 0, vb, 0),
+                 (shoulder + 0.5*model.l1*e1, θ1, vb + 0.5*model.l1*dθ1*n1, dθ1),
+                 (elbow + 0.5*model.l2*e12, θ12, v_elbow + 0.5*model.l2*dθ12*n12, dθ12)]
+        for body, (p, angle, v, ω) in zip(self.links, poses):
+            # pymunk keeps the centre of gravity fixed when the angle is set,
+            # so it must be set before the position
+            body.angle = angle
+            body.position = tuple(p)
+            body.velocity = tuple(v)
+            body.angular_velocity = ω
+            body.force = (0, 0)
+            body.torque = 0
+
+        self.q = np.array(q, dtype=np.float64)
+        self.dq = np.array(dq, dtype=np.float64)
+
+    def reset(self, q0, dq0=None):
+        """Start a new episode from configuration q0 with joint velocities dq0
+        (zero by default), moving the existing robot bodies in place rather
+        than rebuilding the space. Commanded inputs are reset to hold dq0 (for
+        velocity control) or to zero torque. Other bodies added to the space
+        are left where they are.
+
+        The contact and constraint impulses that pymunk keeps to warm-start
+        its solver are discarded as well, so an episode does not depend on
+        the ones before it: the robot then follows a newly built simulation
+        to within rounding error."""
+        if dq0 is None:
+            dq0 = np.zeros(np.shape(q0))
+        self._set_robot_state(q0, dq0)
+        self._clear_impulses()
+        self._reset_inputs(self.dq)
+        return self.q, self.dq
+
+    def _clear_impulses(self):
+        """Discard the cached contact and constraint impulses. Contacts are
+        cached per pair of shapes and dropped when a shape is removed from
+        the space. Constraint impulses cannot be set, so each constraint is
+        replaced by a copy, which starts without any. Shapes and constraints
+        are added back in their original order."""
+        space = self.space
+        shapes = list(space.shapes)
+        space.remove(*shapes)
+        space.add(*shapes)
+
+        constraints = list(space.constraints)
+        copies = [copy.copy(c) for c in constraints]
+        space.remove(*constraints)
+        space.add(*copies)
+        if hasattr(self, 'motors'):
+            self.motors = [copies[constraints.index(m)] for m in self.motors]
+
+    def _reset_inputs(self, dq0):
+        pass
 
     def _read_state(self):
         # subtract q1 from q2, since the angle of link 2 is relative to the
@@ -104,9 +372,85 @@ class PymunkSimulationBase:
                        self.links[2].angular_velocity - self.links[1].angular_velocity])
         return q, dq
 
+    def _motors(self):
+        return [c for c in self.space.constraints
+                if isinstance(c, pymunk.SimpleMotor)]
+
+    def _snapshot_inputs(self):
+        """Copy of the commanded inputs not stored in the bodies or motors."""
+        return None
+
+    def _restore_inputs(self, inputs):
+        pass
+
+    def snapshot(self):
+        """Save the state of all bodies and motors in the space, along with
+        the robot state, commanded inputs and physics step count, so that it can be returned to
+        later with restore.
+
+        Constraint impulses are not included: pymunk does not allow them to
+        be set. After a restore the solver warm-starts from the impulses of
+        the last step instead. Contacts are affected the same way, because
+        their cached impulses cannot be set either. Branched rollouts are
+        therefore physically consistent, but not bit-identical to the
+        original run.
+        """
+        bodies = np.array([(*b.position, b.angle, *b.velocity, b.angular_velocity)
+                           for b in self.space.bodies])
+        motor_rates = np.array([m.rate for m in self._motors()])
+        return PymunkSnapshot(bodies, motor_rates, np.copy(self.q),
+                              np.copy(self.dq), self._snapshot_inputs(),
+                              self.physics_steps)
+
+    def restore(self, snapshot):
+        """Return the simulation to a state saved by snapshot, either from
+        this simulation or from one it was cloned from. Forces and torques
+        are cleared."""
+        bodies = list(self.space.bodies)
+        motors = self._motors()
+        if len(bodies) != len(snapshot.bodies) \
+                or len(motors) != len(snapshot.motor_rates):
+            raise ValueError('Snapshot does not match the bodies and motors '
+                             'of this simulation.')
+
+        for body, (x, y, angle, vx, vy, ω) in zip(bodies, snapshot.bodies):
+            body.position = (x, y)
+            body.angle = angle
+            body.velocity = (vx, vy)
+            body.angular_velocity = ω
+            body.force = (0, 0)
+            body.torque = 0
+        for motor, rate in zip(motors, snapshot.motor_rates):
+            motor.rate = rate
+
+        self.q = np.copy(snapshot.q)
+        self.dq = np.copy(snapshot.dq)
+        self._restore_inputs(snapshot.inputs)
+        self.physics_steps = snapshot.physics_steps
+
+    def clone(self, n=None):
+        """Independent copy of the whole simulation, including any bodies
+        added to the space outside of add_robot. If n is given, a list of n
+        copies is returned. The simulation is serialized once and every copy
+        is deserialized from that, which is much cheaper than building new
+        simulations."""
+        data = pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
+        if n is None:
+            return pickle.loads(data)
+        return [pickle.loads(data) for _ in range(n)]
+
+    def _apply_inputs(self):
+        """Apply the commanded inputs before each physics substep. Pymunk
+        clears body forces and torques after every step, so inputs given that
+        way must be reapplied each time."""
+        pass
+
     def step(self):
-        """Step the simulation forward in time."""
-        self.space.step(self.dt)
+        """Step the simulation forward one control period."""
+        for _ in range(self.substeps):
+            self._apply_inputs()
+            self.space.step(self.physics_dt)
+            self.physics_steps += 1
         self.q, self.dq = self._read_state()
         return self.q, self.dq
 
@@ -117,10 +461,19 @@ class PymunkSimulationTorque(PymunkSimulationBase):
         super().add_robot(model, q0, dynamic=True)
         self.tau = np.zeros(3)
 
+    def _reset_inputs(self, dq0):
+        self.tau = np.zeros(3)
+
     def command_torque(self, tau):
         self.tau = tau
 
-    def _set_torques(self):
+    def _snapshot_inputs(self):
+        return np.copy(self.tau)
+
+    def _restore_inputs(self, inputs):
+        self.tau = np.copy(inputs)
+
+    def _apply_inputs(self):
         # Instead of motors, we directly set the desired torques on the body.
         # Note that each motor adds a torque to both links to which it is
         # connected.
@@ -129,10 +482,6 @@ class PymunkSimulationTorque(PymunkSimulationBase):
         self.links[1].torque = self.tau[1] - self.tau[2]
         self.links[2].torque = self.tau[2]
 
-    def step(self):
-        self._set_torques()
-        return super().step()
-
 
 class PymunkSimulationVelocity(PymunkSimulationBase):
     """Pymunk simulation with velocity-controlled robot."""
@@ -146,6 +495,9 @@ class PymunkSimulationVelocity(PymunkSimulationBase):
 
         self.motors = [motor1, motor2]
 
+    def _reset_inputs(self, dq0):
+        self._set_motor_rates(dq0)
+
     def _set_motor_rates(self, rate):
         self.links[0].velocity = (rate[0], 0)
 
@@ -167,3 +519,179 @@ class PymunkSimulationVelocity(PymunkSimulationBase):
         #                      self.model.acc_lim * self.dt + self.dq)
 
         self._set_motor_rates(rate)
+
+
+# mass of each arm link of the top-down robot, which the kinematic
+# TopDownHolonomicModel does not specify
+TOPDOWN_LINK_MASS = 1.0
+
+# gravity used to compute the friction between objects and the floor in the
+# top-down simulation, which itself has no gravity (m/s**2)
+TOPDOWN_GRAVITY = 9.8
+
+
+class PymunkSimulationTopDown(PymunkSimulationBase):
+    """Top-down pymunk simulation of a velocity-controlled
+    TopDownHolonomicModel, for pushing objects around with real contacts.
+
+    The plane of the simulation is the floor, so there is no gravity.
+    Friction between objects and the floor is modelled by joints to the
+    static body with limited force (see add_circle). The base is a kinematic
+    body with the commanded velocity and the arm links are driven by motors.
+    The arm passes over the base and does not collide with it, but both
+    collide with other bodies.
+
+    The robot state is computed from a batched read of all bodies in the
+    space at the end of each step, so the states of other bodies are
+    available in body_states at no extra cost.
+    """
+    def __init__(self, dt, iterations=10, substeps=1):
+        super().__init__(dt, gravity=0, iterations=iterations,
+                         substeps=substeps)
+
+    def add_robot(self, model, q0):
+        # all robot shapes are in one group, so they do not collide with each
+        # other
+        robot_filter = pymunk.ShapeFilter(group=1)
+
+        # base, with its origin at the shoulder joint
+        base_body = pymunk.Body(body_type=pymunk.Body.KINEMATIC)
+        base = pymunk.Poly.create_box(base_body, (model.bl, model.bw))
+        base.friction = 0.25
+        base.filter = robot_filter
+        self.space.add(base.body, base)
+
+        # arm links
+        links = []
+        for l in (model.l1, model.l2):
+            moment = pymunk.moment_for_segment(TOPDOWN_LINK_MASS, (-0.5*l, 0),
+                                               (0.5*l, 0), 0.05)
+            link_body = pymunk.Body(mass=TOPDOWN_LINK_MASS, moment=moment)
+            link = pymunk.Segment(link_body, (-0.5*l, 0), (0.5*l, 0),
+                                  radius=0.05)
+            link.friction = 0.25
+            link.filter = robot_filter
+            self.space.add(link.body, link)
+            links.append(link)
+        link1, link2 = links
+
+        # end effector "fingers", side by side just beyond the end of link 2
+        # (whose end cap reaches 0.5*l2 + fr), so that they make the contact
+        # in a head-on push
+        fr = 0.05
+        finger1 = pymunk.Circle(link2.body, fr, (0.5*model.l2 + 2*fr, -fr))
+        finger2 = pymunk.Circle(link2.body, fr, (0.5*model.l2 + 2*fr, fr))
+        for finger in (finger1, finger2):
+            finger.friction = 0.75
+            finger.filter = robot_filter
+            finger.collision_type = FINGER_COLLISION_TYPE
+        self.space.add(finger1, finger2)
+        self.fingers = [finger1, finger2]
+
+        self.model = model
+        self.links = [base.body, link1.body, link2.body]
+
+        # the bodies must be in place before the joints are created, since
+        # pin joints keep the distance between their anchors at creation
+        self._set_robot_state(q0, np.zeros(5))
+
+        joint1 = pymunk.PinJoint(base.body, link1.body, (0, 0),
+                                 (-0.5*model.l1, 0))
+        joint2 = pymunk.PinJoint(link1.body, link2.body, (0.5*model.l1, 0),
+                                 (-0.5*model.l2, 0))
+        joint1.collide_bodies = False
+        joint2.collide_bodies = False
+
+        # motors to maintain the desired arm joint velocities
+        motor1 = pymunk.constraints.SimpleMotor(self.links[0], self.links[1], 0)
+        motor2 = pymunk.constraints.SimpleMotor(self.links[1], self.links[2], 0)
+        self.space.add(joint1, joint2, motor1, motor2)
+        self.motors = [motor1, motor2]
+
+    def add_circle(self, r, p0, mass=1.0, mu=0.5):
+        """Add a circular object of radius r and the given mass at position
+        p0, sliding on the floor with coefficient of friction mu. Returns its
+        body, whose state is then included in body_states."""
+        body = pymunk.Body(mass, pymunk.moment_for_circle(mass, 0, r))
+        body.position = tuple(p0)
+        circle = pymunk.Circle(body, r)
+        circle.friction = 0.5
+        self.space.add(body, circle)
+
+        # floor friction: joints to the static body that try to keep the
+        # object still, with force (and torque) limited to the friction force
+        f_max = mu * mass * TOPDOWN_GRAVITY
+        pivot = pymunk.PivotJoint(self.space.static_body, body, (0, 0), (0, 0))
+        gear = pymunk.GearJoint(self.space.static_body, body, 0, 1)
+        for joint in (pivot, gear):
+            joint.max_bias = 0  # no positional correction
+        pivot.max_force = f_max
+        gear.max_force = f_max * r
+        self.space.add(pivot, gear)
+        return body
+
+    def _set_robot_state(self, q, dq):
+        """Place the robot's bodies at configuration q moving with joint
+        velocities dq, and clear their forces."""
+        model = self.model
+        xb, yb, θb, θ1, θ2 = q
+        dxb, dyb, dθb, dθ1, dθ2 = dq
+        θb1 = θb + θ1
+        θb12 = θb1 + θ2
+        dθb1 = dθb + dθ1
+        dθb12 = dθb1 + dθ2
+
+        # unit vectors along and normal to each link
+        e1 = np.array([np.cos(θb1), np.sin(θb1)])
+        n1 = np.array([-e1[1], e1[0]])
+        e12 = np.array([np.cos(θb12), np.sin(θb12)])
+        n12 = np.array([-e12[1], e12[0]])
+
+        shoulder = np.array([xb, yb])
+        elbow = shoulder + model.l1 * e1
+        vb = np.array([dxb, dyb])
+        v_elbow = vb + model.l1 * dθb1 * n1
+
+        poses = [(shoulder, θb, vb, dθb),
+                 (shoulder + 0.5*model.l1*e1, θb1, vb + 0.5*model.l1*dθb1*n1, dθb1),
+                 (elbow + 0.5*model.l2*e12, θb12, v_elbow + 0.5*model.l2*dθb12*n12, dθb12)]
+        for body, (p, angle, v, ω) in zip(self.links, poses):
+            # pymunk keeps the centre of gravity fixed when the angle is set,
+            # so it must be set before the position
+            body.angle = angle
+            body.position = tuple(p)
+            body.velocity = tuple(v)
+            body.angular_velocity = ω
+            body.force = (0, 0)
+            body.torque = 0
+
+        self.q = np.array(q, dtype=np.float64)
+        self.dq = np.array(dq, dtype=np.float64)
+
+    def _reset_inputs(self, dq0):
+        self._set_rates(dq0)
+
+    def _read_state(self):
+        X = self.read_bodies()
+        base, link1, link2 = (X[self.body_row(body)] for body in self.links)
+
+        # arm angles are relative to the previous link
+        q = np.array([base[0], base[1], base[2], link1[2] - base[2],
+                      link2[2] - link1[2]])
+        dq = np.array([base[3], base[4], base[5], link1[5] - base[5],
+                       link2[5] - link1[5]])
+        return q, dq
+
+    def _set_rates(self, rate):
+        self.links[0].velocity = (rate[0], rate[1])
+        self.links[0].angular_velocity = rate[2]
+
+        # Pymunk convention for motors is positive rate = clockwise rotation
+        self.motors[0].rate = -rate[3]
+        self.motors[1].rate = -rate[4]
+
+    def command_velocity(self, rate):
+        # velocity limits; as for PymunkSimulationVelocity, acceleration
+        # limits are not applied
+        rate = bound_array(rate, -self.model.vel_lim, self.model.vel_lim)
+        self._set_rates(rate)
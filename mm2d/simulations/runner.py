@@ -0,0 +1,189 @@
+# Generic closed-loop runner: a controller tracking a trajectory, with either a
+# kinematic model or a velocity-controlled simulation as the plant. All logs
+# are preallocated and the reference is sampled for the whole run up front, so
+# the loop only calls the controller, steps the plant and copies the results
+# into place. Rendering, if any, is done every few steps.
+import inspect
+import time
+
+import numpy as np
+
+from mm2d.util import rms
+from .headless import ThroughputReport
+
+
+class Results:
+    ''' Logs of a closed-loop run, one row per control step. Row k of the
+        states and outputs is at time ts[k]; row k of the inputs us and solve
+        times is applied from ts[k] to ts[k+1] (the last row of each is
+        zero).
+
+        Row k+1 of the reference pds, vds is the reference the controller was
+        given at step k, i.e. the one that produced state k+1, so that each
+        state is compared with the reference it was meant to reach. For the
+        solve(q, dq, pd, vd) form that is the reference at ts[k]; for the MPC
+        form, the first point of its horizon, at ts[k+1]. Row 0 is the
+        initial output, which is not tracked. '''
+    def __init__(self, ts, qs, dqs, us, ps, vs, pds, vds, solve_times, report):
+        self.ts = ts
+        self.qs = qs
+        self.dqs = dqs
+        self.us = us
+        self.ps = ps
+        self.vs = vs
+        self.pds = pds
+        self.vds = vds
+        self.solve_times = solve_times
+        self.report = report
+
+    @property
+    def num_steps(self):
+        ''' Number of control steps run. '''
+        return self.ts.shape[0] - 1
+
+    def tracking_error(self):
+        ''' RMS tracking error of each output, excluding the initial state. '''
+        return np.array([rms(e) for e in (self.pds[1:] - self.ps[1:]).T])
+
+
+def run_closed_loop(plant, controller, trajectory, duration, dt=None, q0=None,
+                    dq0=None, horizon=None, solve=None, stop=None, render=None,
+                    render_every=1):
+    ''' Run controller in closed loop with plant to track trajectory for
+        duration seconds.
+
+        plant is either a kinematic model, in which case dt and q0 must be
+        given, or a velocity-controlled simulation with a robot added, in
+        which case its control period and current state are used. The
+        reference positions and velocities are sampled at all control steps
+        at once, with trajectory.sample.
+
+        By default the controller is called as:
+            controller.solve(q, dq, pd, vd)
+        with the reference at the current time (e.g. the differential IK
+        controllers). If horizon is given, it is called as:
+            controller.solve(q, dq, pr, n)
+        with the flattened reference positions pr of the next n <= horizon
+        steps (e.g. MPC). Otherwise, solve(k, q, dq) is called to get the
+        inputs at step k, for controllers needing other arguments.
+
+        stop(k, q, dq), if given, is checked after each step and ends the run
+        early when it returns True. render(q), if given, is called every
+        render_every steps and after the last one. Neither is included in
+        the solve or step times.
+
+        Returns a Results object. '''
+    if hasattr(plant, 'command_velocity'):
+        model = plant.model
+        dt = plant.dt
+        q = np.copy(plant.q)
+        dq = np.copy(plant.dq)
+        substeps = plant.substeps
+    else:
+        if dt is None or q0 is None:
+            raise ValueError('dt and q0 are required when the plant is a model.')
+        model = plant
+        q = np.array(q0, dtype=np.float64)
+        dq = np.zeros(model.ni) if dq0 is None else np.array(dq0, dtype=np.float64)
+        substeps = 1
+
+    N = int(duration / dt) + 1
+    ni, no = model.ni, model.no
+
+    # reference for the whole run, plus the lookahead of the last steps
+    ts = dt * np.arange(N)
+    n_ref = N if horizon is None else N + horizon
+    pr, vr, _ = trajectory.sample(dt * np.arange(n_ref))
+    pr = np.reshape(pr, (n_ref, -1))
+    vr = np.reshape(vr, (n_ref, -1))
+    if pr.shape[1] != no or vr.shape[1] != no:
+        raise ValueError('Trajectory has {} columns but the model has {} '
+                         'outputs.'.format(pr.shape[1], no))
+    if horizon is not None:
+        pr_flat = np.ascontiguousarray(pr).reshape(-1)
+
+    qs = np.zeros((N, ni))
+    dqs = np.zeros((N, ni))
+    us = np.zeros((N, ni))
+    ps = np.zeros((N, no))
+    vs = np.zeros((N, no))
+    solve_times = np.zeros(N)
+    J = np.zeros((no, ni))
+    forward = _with_out(model.forward)
+    jacobian = _with_out(model.jacobian)
+
+    qs[0] = q
+    dqs[0] = dq
+    forward(q, out=ps[0])
+    np.dot(jacobian(q, out=J), dq, out=vs[0])
+
+    solve_time = step_time = 0
+    num_steps = N - 1
+    t_start = time.perf_counter()
+    for k in range(N - 1):
+        t0 = time.perf_counter()
+        if solve is not None:
+            u = solve(k, q, dq)
+        elif horizon is None:
+            u = controller.solve(q, dq, pr[k], vr[k])
+        else:
+            n = min(horizon, N - 1 - k)
+            u = controller.solve(q, dq, pr_flat[(k+1)*no:(k+1+n)*no], n)
+        t1 = time.perf_counter()
+
+        if plant is model:
+            q, dq = model.step(q, u, dt, dq_last=dq)
+        else:
+            plant.command_velocity(u)
+            q, dq = plant.step()
+        t2 = time.perf_counter()
+
+        solve_time += t1 - t0
+        step_time += t2 - t1
+        solve_times[k] = t1 - t0
+        us[k] = u
+        qs[k+1] = q
+        dqs[k+1] = dq
+        forward(q, out=ps[k+1])
+        np.dot(jacobian(q, out=J), dq, out=vs[k+1])
+
+        if render is not None and (k + 1) % render_every == 0:
+            render(q)
+        if stop is not None and stop(k, q, dq):
+            num_steps = k + 1
+            break
+    wall_time = time.perf_counter() - t_start
+
+    # make sure the final state is shown
+    if render is not None and num_steps % render_every != 0:
+        render(q)
+
+    n = num_steps + 1
+
+    # reference given at each step, aligned with the state it produced
+    offset = 0 if horizon is None else 1
+    pds = np.empty((n, no))
+    vds = np.empty((n, no))
+    pds[0], vds[0] = ps[0], vs[0]
+    pds[1:] = pr[offset:offset+num_steps]
+    vds[1:] = vr[offset:offset+num_steps]
+
+    report = ThroughputReport(num_steps, substeps, dt, solve_time, step_time,
+                              wall_time)
+    return Results(ts[:n], qs[:n], dqs[:n], us[:n], ps[:n], vs[:n], pds,
+                   vds, solve_times[:n], report)
+
+
+def _with_out(f):
+    ''' Wrap the kinematics function f(q) so it can be called as f(q, out=out),
+        for models (such as the JAX one) whose functions do not take out. '''
+    try:
+        if 'out' in inspect.signature(f).parameters:
+            return f
+    except (TypeError, ValueError):
+        pass
+
+    def f_out(q, out):
+        out[...] = f(q)
+        return out
+    return f_out
@@ -204,10 +204,10 @@ class Circle:
         p = self.pc + self.r * np.array([cs, ss]).T
 
         dpds = 2*np.pi*self.r * np.array([-ss, cs])
-        v = dpds * ds
+        v = (dpds * ds).T
 
         dpds2 = 4*np.pi**2*self.r * np.array([-cs, -ss])
-        a = dpds * dds + dpds2 * ds**2
+        a = (dpds * dds + dpds2 * ds**2).T
 
         if flatten:
             return p.flatten(), v.flatten(), a.flatten()
@@ -1,14 +1,194 @@
+import importlib
+import os
+import time
+import warnings
+from collections import OrderedDict
+
 import numpy as np
 
 
+# default location of the persistent JAX compilation cache
+JAX_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'mm2d', 'jax')
+
+# implementations of the hot per-configuration model functions: plain NumPy,
+# or kernels compiled with numba (see mm2d.models.kernels)
+BACKENDS = ('numpy', 'numba')
+
+
+class LazyModule:
+    ''' Proxy for a module that is only imported when one of its attributes
+        is first accessed. Used for heavy optional dependencies (qpOASES,
+        matplotlib) so that importing mm2d stays fast. '''
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+def load_kernels(backend):
+    ''' Module of compiled kernels for the hot model functions for the given
+        backend, or None for the NumPy backend. If the dependency of a
+        compiled backend is not installed, a warning is issued and None is
+        returned, so that models fall back to their NumPy implementations. '''
+    if backend not in BACKENDS:
+        raise ValueError('Unknown backend {}; expected one of {}.'.format(
+            backend, BACKENDS))
+    if backend == 'numpy':
+        return None
+    try:
+        return importlib.import_module('mm2d.models.kernels')
+    except ImportError:
+        warnings.warn('{} is not installed; falling back to the NumPy '
+                      'backend.'.format(backend))
+        return None
+
+
+def enable_compilation_cache(path=JAX_CACHE_DIR):
+    ''' Enable JAX's persistent on-disk compilation cache, so that restarted
+        processes load compiled functions from path instead of recompiling
+        them. Returns True if the cache could be enabled with the installed
+        version of JAX. '''
+    import jax
+
+    os.makedirs(path, exist_ok=True)
+    try:
+        jax.config.update('jax_compilation_cache_dir', path)
+    except (AttributeError, KeyError):
+        # older versions of JAX only expose the experimental interface
+        try:
+            from jax.experimental.compilation_cache import compilation_cache
+        except ImportError:
+            warnings.warn('Installed JAX does not support a persistent '
+                          'compilation cache.')
+            return False
+        compilation_cache.initialize_cache(path)
+        return True
+
+    # by default only expensive compilations are persisted, but the small
+    # model and MPC functions are exactly the ones we want to keep
+    for option in ('jax_persistent_cache_min_compile_time_secs',
+                   'jax_persistent_cache_min_entry_size_bytes'):
+        try:
+            jax.config.update(option, 0)
+        except (AttributeError, KeyError):
+            pass
+    return True
+
+
+def warmup(fun, *args):
+    ''' Compile a jitted function ahead of time for the shapes and dtypes of
+        args by calling it once and waiting for the result. Functions that
+        are not jitted (returning NumPy arrays) are just called once, so a
+        controller's functions can be warmed up together whatever they are.
+        Returns the elapsed time in seconds. '''
+    import jax
+
+    def block(x):
+        return x.block_until_ready() if hasattr(x, 'block_until_ready') else x
+
+    t0 = time.perf_counter()
+    jax.tree_util.tree_map(block, fun(*args))
+    return time.perf_counter() - t0
+
+
 def rms(e):
     ''' Calculate root mean square of a vector of data. '''
     return np.sqrt(np.mean(np.square(e)))
 
 
-def bound_array(a, lb, ub):
-    ''' Elementwise bound array above and below. '''
-    return np.minimum(np.maximum(a, lb), ub)
+def bound_array(a, lb, ub, out=None):
+    ''' Elementwise bound array above and below. If out is given, the result
+        is written into it rather than a new array. '''
+    if out is None:
+        return np.minimum(np.maximum(a, lb), ub)
+    np.maximum(a, lb, out=out)
+    return np.minimum(out, ub, out=out)
+
+
+class ConfigurationCache:
+    ''' Small least-recently-used cache of quantities derived from a
+        configuration. Entries are keyed by the contents of the configuration
+        buffer, so repeated queries with the same q (even a different array
+        object holding the same values) reuse the stored result.
+
+        Once the cache is full, a miss recomputes the least recently used
+        entry in place with its update method (if it has one) rather than
+        creating a new one, so a stream of new configurations allocates no new
+        entries. A returned value is therefore only valid until maxsize
+        further misses. '''
+    def __init__(self, func, maxsize=8):
+        self.func = func
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+
+        # most recent query, which is checked first
+        self._last_key = None
+        self._last_value = None
+
+    def __call__(self, q):
+        if type(q) is not np.ndarray or q.dtype != np.float64:
+            q = np.asarray(q, dtype=np.float64)
+        key = (q.shape, q.tobytes())
+        if key == self._last_key:
+            return self._last_value
+
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        elif len(self._entries) >= self.maxsize:
+            _, value = self._entries.popitem(last=False)
+            if hasattr(value, 'update'):
+                value.update(q)
+            else:
+                value = self.func(q)
+            self._entries[key] = value
+        else:
+            value = self.func(q)
+            self._entries[key] = value
+
+        self._last_key = key
+        self._last_value = value
+        return value
+
+    def clear(self):
+        ''' Remove all cached entries. '''
+        self._entries.clear()
+        self._last_key = None
+        self._last_value = None
+
+
+def bounded_rollout(q0, dq0, U, dt, vel_lim, acc_lim):
+    ''' Integrate a sequence of velocity inputs with the same velocity and
+        acceleration clamping as the models' step functions.
+
+        U has shape (..., N, ni): a sequence of N inputs, optionally with
+        leading batch dimensions. q0 and dq0 have shape (ni,) or (..., ni) and
+        broadcast against the batch. If dq0 is None, the first input is only
+        velocity-limited, matching step(..., dq_last=None).
+
+        Returns the configurations and velocities after each step, both with
+        shape (..., N, ni). '''
+    U = np.asarray(U, dtype=np.float64)
+    q0 = np.asarray(q0, dtype=np.float64)
+
+    # velocity limits do not depend on the history, so apply them all at once
+    dqs = bound_array(U, -vel_lim, vel_lim)
+
+    # acceleration limits couple consecutive steps, so scan forward in time
+    # over the whole batch
+    dq_last = dqs[..., 0, :] if dq0 is None else np.asarray(dq0)
+    dv = acc_lim * dt
+    for k in range(dqs.shape[-2]):
+        dq = dqs[..., k, :]
+        np.minimum(np.maximum(dq, dq_last - dv), dq_last + dv, out=dq)
+        dq_last = dq
+
+    qs = q0[..., None, :] + dt * np.cumsum(dqs, axis=-2)
+    return qs, dqs
 
 
 def right_pseudoinverse(J):
@@ -28,6 +208,46 @@ def rotation_jacobian(θ):
                      [ np.cos(θ), -np.sin(θ)]])
 
 
+def wrap_to_pi(θ):
+    ''' Wrap angles to the interval [-π, π). '''
+    return (θ + np.pi) % (2 * np.pi) - np.pi
+
+
+def two_link_ik(dx, dy, l1, l2, elbow_up=True):
+    ''' Closed-form inverse kinematics of a planar two-link arm. Finds the
+        absolute angle φ1 of link 1 and the angle θ2 of link 2 relative to
+        link 1 that place the end of the arm at (dx, dy) relative to its
+        shoulder. elbow_up selects the branch with θ2 <= 0. Targets out of
+        reach are projected onto the boundary of the workspace; the returned
+        mask indicates which targets were reachable. Vectorized over arrays of
+        targets. '''
+    c2 = (dx**2 + dy**2 - l1**2 - l2**2) / (2 * l1 * l2)
+    reachable = np.abs(c2) <= 1
+    θ2 = np.arccos(np.clip(c2, -1, 1))
+    θ2 = np.where(elbow_up, -θ2, θ2)
+    φ1 = np.arctan2(dy, dx) - np.arctan2(l2 * np.sin(θ2), l1 + l2 * np.cos(θ2))
+    return φ1, θ2, reachable
+
+
+def dist_to_line_segments(p, p1, p2):
+    ''' Vectorized version of dist_to_line_segment: closest points and
+        squared distances from points p to the line segments with end points
+        p1 and p2. All arguments have shape (..., 2) and are broadcast
+        against each other, so that e.g. the links of a whole trajectory of
+        robot configurations can be checked against a point at once. '''
+    v = p2 - p1
+    length2 = np.sum(v**2, axis=-1)
+
+    # parameter of the closest point along each segment, clipped to its ends
+    with np.errstate(invalid='ignore', divide='ignore'):
+        s = np.sum((p - p1) * v, axis=-1) / length2
+    s = np.clip(np.nan_to_num(s), 0, 1)
+
+    pc = p1 + s[..., None] * v
+    d2 = np.sum((p - pc)**2, axis=-1)
+    return pc, d2
+
+
 def dist_to_line_segment(p, p1, p2):
     ''' Calculate distance and closest point of p to the line segment with end
         points p1 and p2. '''
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""Throughput of the batched NumPy torque simulation versus pymunk.
+
+The same gravity-compensated PD regulation task is run with
+PymunkSimulationTorque and with BatchSimulationTorque, which switch by
+changing only the constructor. We report the agreement between the two for a
+single robot and the number of robot-steps simulated per second for each
+backend and batch size.
+"""
+import time
+
+import numpy as np
+
+from mm2d import models
+from mm2d.simulations import BatchSimulationTorque, PymunkSimulationTorque
+
+
+DT = 0.01        # control period (s)
+SUBSTEPS = 10    # physics steps per control period
+NUM_STEPS = 200
+BATCH_SIZES = [1, 10, 100, 1000]
+
+KP = 50
+KD = 10
+
+Q_NOMINAL = np.array([0, np.pi/4.0, -np.pi/4.0])
+
+
+def run(sim, model, num_steps):
+    q, dq = sim.q, sim.dq
+    qs = [q]
+    t0 = time.perf_counter()
+    for _ in range(num_steps):
+        α = KP * (Q_NOMINAL - q) - KD * dq
+        tau = np.einsum('...ij,...j->...i', model.mass_matrix(q), α) \
+                + model.gravity_vector(q)
+        sim.command_torque(tau)
+        q, dq = sim.step()
+        qs.append(q)
+    return np.array(qs), time.perf_counter() - t0
+
+
+def main():
+    model = models.ThreeInputModel()
+    rng = np.random.default_rng(0)
+    q0 = Q_NOMINAL + 0.2 * rng.standard_normal(3)
+
+    pymunk_sim = PymunkSimulationTorque(DT, substeps=SUBSTEPS)
+    pymunk_sim.add_robot(model, q0)
+    qs_pymunk, t_pymunk = run(pymunk_sim, model, NUM_STEPS)
+
+    # pymunk integrates with semi-implicit Euler, so use the same here
+    batch_sim = BatchSimulationTorque(DT, substeps=SUBSTEPS,
+                                      integrator='semi_implicit')
+    batch_sim.add_robot(model, q0)
+    qs_batch, _ = run(batch_sim, model, NUM_STEPS)
+
+    print('max difference between backends for one robot: {:.2e}'.format(
+        np.max(np.abs(qs_pymunk - qs_batch))))
+    print('{:>10} {:>20}'.format('backend', 'robot-steps/s'))
+    print('{:>10} {:>20.0f}'.format('pymunk', NUM_STEPS / t_pymunk))
+
+    for B in BATCH_SIZES:
+        sim = BatchSimulationTorque(DT, substeps=SUBSTEPS)
+        sim.add_robot(model, Q_NOMINAL + 0.2 * rng.standard_normal((B, 3)))
+        _, t = run(sim, model, NUM_STEPS)
+        print('{:>10} {:>20.0f}'.format('batch {}'.format(B), B * NUM_STEPS / t))
+
+
+if __name__ == '__main__':
+    main()
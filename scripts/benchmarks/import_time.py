@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""Import-time benchmark for the mm2d package.
+
+Each module is imported in a fresh interpreter, so the measured time is the
+cold-start cost paid by a short-lived worker process. The script exits with a
+non-zero status if importing a module pulls in one of the heavy optional
+dependencies, or if it takes longer than the time budget, so it can be used to
+guard against regressions.
+"""
+import subprocess
+import sys
+
+
+NUM_TRIALS = 5      # take the best of this many cold imports
+TIME_BUDGET = 0.5   # maximum allowed import time per module (s)
+
+# modules that should be importable without paying for heavy dependencies
+MODULES = ['mm2d.models', 'mm2d.control', 'mm2d.simulations', 'mm2d.plotter',
+           'mm2d.trajectory', 'mm2d.obstacle', 'mm2d.util', 'mm2d.estimation',
+           'mm2d.manipulability', 'mm2d.recording']
+
+# dependencies that must only be imported by the features that need them
+HEAVY_MODULES = ['jax', 'qpoases', 'pymunk', 'matplotlib', 'IPython']
+
+PROGRAM = '''
+import sys, time
+t0 = time.perf_counter()
+import {module}
+t = time.perf_counter() - t0
+heavy = [m for m in {heavy!r} if m in sys.modules]
+print(t, ','.join(heavy))
+'''
+
+
+def time_import(module):
+    ''' Import module in a fresh interpreter, returning the import time and
+        the heavy modules that were loaded along with it. '''
+    program = PROGRAM.format(module=module, heavy=HEAVY_MODULES)
+    out = subprocess.check_output([sys.executable, '-c', program], text=True)
+    t, heavy = out.split()[0], out.split()[1:]
+    return float(t), heavy[0].split(',') if heavy else []
+
+
+def main():
+    failed = False
+    for module in MODULES:
+        results = [time_import(module) for _ in range(NUM_TRIALS)]
+        t = min(result[0] for result in results)
+        heavy = results[0][1]
+
+        status = 'ok'
+        if heavy:
+            status = 'FAIL: imports {}'.format(', '.join(heavy))
+            failed = True
+        elif t > TIME_BUDGET:
+            status = 'FAIL: over budget of {} s'.format(TIME_BUDGET)
+            failed = True
+        print('{:<20} {:8.1f} ms  {}'.format(module, 1000 * t, status))
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""Startup and first-tick latency of the JAX-based model.
+
+A fresh worker process is launched several times against the same on-disk
+compilation cache. The first worker starts with an empty cache and has to
+compile everything; later workers should load the compiled functions from the
+cache and start much faster. For each worker we report the time to construct
+and warm up the model and the latency of the first control tick afterwards.
+"""
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+
+NUM_WORKERS = 3
+HORIZON = 10     # MPC horizon length to compile for
+BATCH_SIZE = 64  # number of candidate input sequences evaluated at once
+
+
+def worker(cache_dir):
+    ''' Measure startup and first-tick latency in this process. '''
+    t0 = time.perf_counter()
+    from mm2d import util
+    from mm2d.models import TopDownHolonomicModelAD
+
+    util.enable_compilation_cache(cache_dir)
+    model = TopDownHolonomicModelAD(1, 1, 1, 1)
+    model.warmup(horizons=[HORIZON], batch_sizes=[BATCH_SIZE])
+    startup = time.perf_counter() - t0
+
+    # one tick: roll out candidate inputs and evaluate the kinematics along
+    # the nominal horizon
+    q0 = np.zeros(model.ni)
+    U = np.zeros((BATCH_SIZE, HORIZON, model.ni))
+    t0 = time.perf_counter()
+    qs, _ = model.rollout(q0, None, U, 0.1)
+    P, J = model.kinematics_batch(qs[0])
+    np.asarray(J)
+    first_tick = time.perf_counter() - t0
+
+    print(startup, first_tick)
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == '--worker':
+        worker(sys.argv[2])
+        return
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for i in range(NUM_WORKERS):
+            out = subprocess.check_output(
+                [sys.executable, __file__, '--worker', cache_dir], text=True)
+            startup, first_tick = map(float, out.split()[-2:])
+            print('worker {} ({} cache): startup {:.3f} s, first tick {:.2f} ms'.format(
+                i, 'cold' if i == 0 else 'warm', startup, 1000 * first_tick))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""Per-call cost of the hot model functions for each backend.
+
+Each function is called on a new configuration every time, as a controller
+running at a high rate would be, cycling through more configurations than the
+models cache trigonometric terms for so that every call does the full work.
+The best-of-several mean time per call is reported for the NumPy implementation and for the compiled numba kernels (if
+numba is installed), along with the resulting speedup.
+"""
+import itertools
+import timeit
+import warnings
+
+import numpy as np
+
+from mm2d import models, util
+
+
+NUMBER = 10000  # calls per timing
+REPEAT = 5      # take the best of this many timings
+
+# configurations cycled through, many more than the trig cache holds
+NUM_CONFIGS = 1000
+
+
+def time_per_call(f, *args):
+    """Time f called on successive rows of the arrays args."""
+    f(*(a[0] for a in args))  # compile
+    rows = itertools.cycle(list(zip(*args)))
+    return min(timeit.repeat(lambda: f(*next(rows)), number=NUMBER,
+                             repeat=REPEAT)) / NUMBER
+
+
+def benchmark(make_model, functions, Q, dQ):
+    times = {}
+    for backend in util.BACKENDS:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            model = make_model(backend)
+        if model.backend != backend:
+            continue
+        for name in functions:
+            args = (Q, dQ) if name == 'dJdt' else (Q,)
+            times[backend, name] = time_per_call(getattr(model, name), *args)
+    return times
+
+
+def report(title, functions, times):
+    print(title)
+    for name in functions:
+        t_np = times['numpy', name]
+        line = '  {:<16} numpy {:7.2f} us'.format(name, 1e6 * t_np)
+        if ('numba', name) in times:
+            t_nb = times['numba', name]
+            line += '   numba {:7.2f} us   speedup {:5.1f}x'.format(
+                1e6 * t_nb, t_np / t_nb)
+        print(line)
+
+
+def main():
+    rng = np.random.default_rng(0)
+    try:
+        import numba  # noqa: F401
+    except ImportError:
+        print('numba is not installed; timing the NumPy backend only\n')
+
+    functions = models.side.COMPILED_FUNCTIONS
+    Q, dQ = rng.standard_normal((2, NUM_CONFIGS, 3))
+    times = benchmark(lambda b: models.ThreeInputModel(backend=b), functions, Q, dQ)
+    report('ThreeInputModel', functions, times)
+
+    functions = models.topdown.COMPILED_FUNCTIONS
+    Q, dQ = rng.standard_normal((2, NUM_CONFIGS, 5))
+    times = benchmark(lambda b: models.TopDownHolonomicModel(1, 1, 1, 1, backend=b),
+                      functions, Q, dQ)
+    report('TopDownHolonomicModel', functions, times)
+
+
+if __name__ == '__main__':
+    main()
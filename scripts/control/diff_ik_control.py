@@ -1,10 +1,11 @@
 #!/usr/bin/env python
+import argparse
+
 import numpy as np
 import matplotlib.pyplot as plt
 
-from mm2d import models, control, plotter
+from mm2d import models, control, plotter, recording, simulations
 from mm2d import trajectory as trajectories
-from mm2d.util import rms
 
 import IPython
 
@@ -20,6 +21,14 @@ DURATION = 10.0  # duration of trajectory (s)
 
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--record', metavar='PATH',
+                        help='Record the run to PATH (.npz).')
+    parser.add_argument('--replay', metavar='PATH',
+                        help='Replay the controller on a run recorded to PATH '
+                             'and compare its outputs and solve times.')
+    args = parser.parse_args()
+
     N = int(DURATION / DT) + 1
 
     model = models.ThreeInputModel(l1=L1, l2=L2, vel_lim=VEL_LIM,
@@ -27,15 +36,23 @@ def main():
 
     W = 0.1 * np.eye(model.ni)
     K = np.eye(model.no)
-    controller = control.DiffIKController(model, W, K, DT, VEL_LIM, ACC_LIM)
+
+    def make_controller():
+        return control.DiffIKController(model, W, K, DT, VEL_LIM, ACC_LIM)
+    controller = make_controller()
+
+    if args.replay:
+        report = recording.replay(recording.Recording.load(args.replay),
+                                  controller, repeat=5,
+                                  make_controller=make_controller)
+        print(report)
+        return
+
+    if args.record:
+        recorder = recording.Recorder(N - 1, metadata={'dt': DT})
+        controller = recording.RecordedController(controller, recorder)
 
     ts = DT * np.arange(N)
-    qs = np.zeros((N, model.ni))
-    dqs = np.zeros((N, model.ni))
-    us = np.zeros((N, model.ni))
-    ps = np.zeros((N, model.no))
-    vs = np.zeros((N, model.no))
-    pds = np.zeros((N, model.no))
 
     q0 = np.array([0, np.pi/4.0, -np.pi/4.0])
     p0 = model.forward(q0)
@@ -69,47 +86,30 @@ def main():
     # plt.ylabel('Reference signal')
     # plt.show()
 
-    q = q0
-    p = p0
-    dq = np.zeros(model.ni)
-    qs[0, :] = q0
-    ps[0, :] = p0
-    pds[0, :] = p0
-
     robot_renderer = plotter.ThreeInputRenderer(model, q0)
     trajectory_renderer = plotter.TrajectoryRenderer(trajectory, ts)
     plot = plotter.RealtimePlotter([robot_renderer, trajectory_renderer])
     plot.start(grid=True)
 
-    for i in range(N - 1):
-        t = ts[i]
-
-        # controller
-        pd, vd, ad = trajectory.sample(t, flatten=True)
-        u = controller.solve(q, dq, pd, vd)
-
-        # step the model
-        q, dq = model.step(q, u, DT, dq_last=dq)
-        p = model.forward(q)
-        v = model.jacobian(q).dot(dq)
-
-        # record
-        us[i, :] = u
-        dqs[i+1, :] = dq
-        qs[i+1, :] = q
-        ps[i+1, :] = p
-        pds[i+1, :] = pd[:model.no]
-        vs[i+1, :] = v
-
-        # render
+    def render(q):
         robot_renderer.set_state(q)
         plot.update()
+
+    results = simulations.run_closed_loop(model, controller, trajectory,
+                                          DURATION, dt=DT, q0=q0,
+                                          render=render)
     plot.done()
+    print(results.report)
+
+    if args.record:
+        recorder.save(args.record)
+
+    ts, qs, dqs, us = results.ts, results.qs, results.dqs, results.us
+    ps, vs, pds = results.ps, results.vs, results.pds
 
-    xe = pds[1:, 0] - ps[1:, 0]
-    ye = pds[1:, 1] - ps[1:, 1]
-    print('RMSE(x) = {}'.format(rms(xe)))
-    print('RMSE(y) = {}'.format(rms(ye)))
+    rmse = results.tracking_error()
+    print('RMSE(x) = {}'.format(rmse[0]))
+    print('RMSE(y) = {}'.format(rmse[1]))
 
     plt.figure()
     plt.plot(ts, pds[:, 0], label='$x_d$', color='b', linestyle='--')
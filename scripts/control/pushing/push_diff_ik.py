@@ -1,9 +1,11 @@
 #!/usr/bin/env python
+import argparse
+
 import numpy as np
 from numpy.linalg import norm
 import matplotlib.pyplot as plt
 
-from mm2d import models, control, obstacle, plotter
+from mm2d import models, control, obstacle, plotter, simulations
 from mm2d.util import rms
 
 import IPython
@@ -17,6 +19,7 @@ ACC_LIM = 1
 
 DT = 0.1      # simulation timestep (s)
 DURATION = 30.0  # duration of trajectory (s)
+PYMUNK_SUBSTEPS = 10  # physics steps per control step with --pymunk
 
 
 def unit(a):
@@ -24,6 +27,12 @@ def unit(a):
 
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pymunk', action='store_true',
+                        help='Push the object with pymunk contact dynamics '
+                             'rather than the spring model.')
+    args = parser.parse_args()
+
     N = int(DURATION / DT) + 1
 
     model = models.TopDownHolonomicModel(L1, L2, VEL_LIM, acc_lim=ACC_LIM, output_idx=[0, 1])
@@ -53,6 +62,11 @@ def main():
     # goal position
     pg = np.array([5., 0])
 
+    if args.pymunk:
+        sim = simulations.PymunkSimulationTopDown(DT, substeps=PYMUNK_SUBSTEPS)
+        sim.add_robot(model, q)
+        circle = sim.add_circle(obs.r, pc)
+
     qs[0, :] = q
     ps[0, :] = p
     pds[0, :] = p
@@ -107,15 +121,22 @@ def main():
 
         u = controller.solve(q, dq, pd, vd, A=A, lbA=lbA, ubA=None)
 
-        # step the model
-        q, dq = model.step(q, u, DT, dq_last=dq)
+        # step the model or simulation
+        if args.pymunk:
+            sim.command_velocity(u)
+            q, dq = sim.step()
+        else:
+            q, dq = model.step(q, u, DT, dq_last=dq)
         p = model.forward(q)
         v = model.jacobian(q).dot(dq)
 
         # obstacle interaction
-        f = obs.calc_point_force(pc, p)
-        f, movement = obs.apply_force(f)
-        pc += movement
+        if args.pymunk:
+            pc = sim.body_states[sim.body_row(circle), :2].copy()
+        else:
+            f = obs.calc_point_force(pc, p)
+            f, movement = obs.apply_force(f)
+            pc += movement
 
         # if object is close enough to the goal position, stop
         if np.linalg.norm(pg - pc) < 0.1:
@@ -107,9 +107,7 @@ def main():
 
         # obstacle interaction TODO refactor
         f1 = obs.calc_point_force(pc, p)
-        xbase, ybase = robot_renderer.calc_base_points(q)
-        pb1 = np.array([xbase[1], ybase[1]])
-        pb2 = np.array([xbase[2], ybase[2]])
+        pb1, pb2 = model.base_corners_batch(q)[1:3]
         f2 = obs.calc_line_segment_force(pc, pb1, pb2)
         f, movement = obs.apply_force(f1+f2)
         if pc[0] <= 2:
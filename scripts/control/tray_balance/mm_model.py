@@ -1,6 +1,7 @@
 import numpy as np
 import jax
 import jax.numpy as jnp
+from mm2d import util
 from mm2d.util import bound_array
 
 import IPython
@@ -26,6 +27,13 @@ class ThreeInputModel:
         self.jacobian = jax.jit(jax.jacrev(self.ee_position))
         self.dJdq = jax.jit(jax.jacfwd(self.jacobian))
 
+    def warmup(self):
+        ''' Compile the Jacobian functions ahead of time. Returns the time
+            spent compiling each, in seconds. '''
+        q = np.zeros(self.ni)
+        return {'jacobian': util.warmup(self.jacobian, q),
+                'dJdq': util.warmup(self.dJdq, q)}
+
     def ee_position(self, X):
         q = X[:self.ni]
         p = jnp.array([q[0] + self.l1*jnp.cos(q[1]) + self.l2*jnp.cos(q[1]+q[2]),
@@ -66,7 +74,9 @@ class ThreeInputModel:
 
 
 def main():
+    util.enable_compilation_cache()
     model = ThreeInputModel(1, 1, 1, 1)
+    print('Compilation times: {}'.format(model.warmup()))
     q1 = np.array([0., 0., 0.])
     q2 = np.array([1., 0.25*np.pi, -0.5*np.pi])
     IPython.embed()
@@ -1,4 +1,6 @@
 #!/usr/bin/env python
+import time
+
 import jax.numpy as jnp
 import jax
 import numpy as np
@@ -122,6 +124,17 @@ class MPC(object):
 
         return var
 
+    def warmup(self, x0, xd):
+        ''' Compile the objective and constraint functions ahead of time for
+            the shapes of x0 and xd, including every function _lookahead calls
+            on the first tick. Returns the time spent compiling each, in
+            seconds. '''
+        var = np.zeros(nv * n)
+        funcs = {'obj_hess': self.obj_hess, 'obj_jac': self.obj_jac,
+                 'eq_fun': self.eq_fun, 'eq_jac': self.eq_jac,
+                 'ineq_fun': self.ineq_fun, 'ineq_jac': self.ineq_jac}
+        return {name: util.warmup(fun, x0, xd, var) for name, fun in funcs.items()}
+
     def solve(self, x0, xd):
         ''' Solve the MPC problem at current state x0 given desired trajectory
             xd. '''
@@ -136,6 +149,10 @@ class MPC(object):
 
 
 def main():
+    # load previously compiled functions from disk, if available
+    util.enable_compilation_cache()
+    t_start = time.perf_counter()
+
     N = int(DURATION / SIM_DT) + 1
 
     # tray params
@@ -261,6 +278,12 @@ def main():
     controller = MPC(obj_fun, obj_jac, obj_hess, eq_fun, eq_jac,
                      ineq_con_unrolled, ineq_con_unrolled_jac)
 
+    # compile everything before the control loop starts
+    compile_times = controller.warmup(x, np.zeros(ns*n))
+    print('Startup took {:.3f} s (compilation: {})'.format(
+        time.perf_counter() - t_start,
+        ', '.join('{} {:.3f} s'.format(k, v) for k, v in compile_times.items())))
+
     for i in range(N - 1):
         t = ts[i+1]
         t_sample = np.minimum(t + MPC_DT*np.arange(n), DURATION)
@@ -272,7 +295,10 @@ def main():
                 xd[j*ns+3:(j+1)*ns] = vd[j*3:(j+1)*3]
         except ValueError:
             IPython.embed()
+        t_solve = time.perf_counter()
         u = controller.solve(x, xd)
+        if i == 0:
+            print('First tick took {:.3f} s'.format(time.perf_counter() - t_solve))
 
         # integrate the system
         x = model.step(x, u, SIM_DT)  #A.dot(x) + B.dot(u)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""Identify the inertial parameters of ThreeInputModel from a torque log.
+
+A batch of robots is driven with random torques. The joint accelerations are
+recovered from the logged velocities by finite differences, and the logged
+torques are corrupted with noise. The parameters are then identified both in
+one batch least-squares solve over the whole log and online with recursive
+least squares.
+"""
+import time
+
+import numpy as np
+
+from mm2d import models, estimation
+
+
+DT = 0.001
+DURATION = 2.0
+BATCH_SIZE = 100
+TAU_NOISE = 0.1  # standard deviation of torque measurement noise (Nm)
+
+
+def main():
+    model = models.ThreeInputModel()
+    θ_true = model.dynamic_parameters()
+    rng = np.random.default_rng(0)
+
+    # simulate a batch of robots under random torques
+    N = int(DURATION / DT)
+    q = np.array([0, np.pi/4.0, -np.pi/4.0]) + 0.1 * rng.standard_normal((BATCH_SIZE, 3))
+    dq = np.zeros((BATCH_SIZE, 3))
+    qs = np.zeros((N + 1, BATCH_SIZE, 3))
+    dqs = np.zeros((N + 1, BATCH_SIZE, 3))
+    taus = np.zeros((N, BATCH_SIZE, 3))
+    qs[0], dqs[0] = q, dq
+    for k in range(N):
+        taus[k] = model.gravity_vector(q) + 5 * rng.standard_normal((BATCH_SIZE, 3))
+        q, dq = model.command_torque(q, dq, taus[k], DT, integrator='semi_implicit')
+        qs[k+1], dqs[k+1] = q, dq
+
+    # the semi-implicit integrator applies the acceleration from state k
+    ddqs = (dqs[1:] - dqs[:-1]) / DT
+    taus_meas = taus + TAU_NOISE * rng.standard_normal(taus.shape)
+
+    t0 = time.perf_counter()
+    Y = model.regressor(qs[:-1], dqs[:-1], ddqs)
+    θ_batch = estimation.least_squares(Y, taus_meas)
+    t_batch = time.perf_counter() - t0
+
+    rls = estimation.RecursiveLeastSquares(np.ones_like(θ_true))
+    t0 = time.perf_counter()
+    for k in range(N):
+        rls.update(Y[k], taus_meas[k])
+    t_rls = time.perf_counter() - t0
+
+    print('{} samples of {} robots'.format(N, BATCH_SIZE))
+    print('{:>6} {:>10} {:>10} {:>10}'.format('param', 'true', 'batch', 'rls'))
+    for name, θt, θb, θr in zip(models.side.DYNAMIC_PARAMETERS, θ_true,
+                                θ_batch, rls.θ):
+        print('{:>6} {:>10.4f} {:>10.4f} {:>10.4f}'.format(name, θt, θb, θr))
+    print('batch: {:.3f} s, rls: {:.3f} s'.format(t_batch, t_rls))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,7 +3,7 @@
 import numpy as np
 import matplotlib.pyplot as plt
 
-import IPython
+from mm2d import estimation
 
 
 # object
@@ -62,8 +62,7 @@ def main():
     A = (x - xo)[contact, None]
     b = f[contact]
 
-    eps = 0
-    params = np.linalg.solve(A.T @ A, A.T @ b)
+    params = estimation.least_squares(A, b)
 
     k_est = params[0]
     w_est = np.mean(f[moving])
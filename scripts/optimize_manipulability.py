@@ -1,11 +1,9 @@
 #!/usr/bin/env python
 
 import numpy as np
-import scipy.optimize as opt
 
-from mm2d.model import ThreeInputModel
-
-import IPython
+from mm2d.models import ThreeInputModel
+from mm2d import manipulability
 
 # model parameters
 # link lengths
@@ -17,43 +15,31 @@ LB = -1
 UB = 1
 
 
-def main():
-    model = ThreeInputModel(L1, L2, LB, UB, output_idx=[0, 1])
-
-    def manipulability(qa):
-        # Only for the arm
-        q = np.array([0, qa[0], qa[1]])
-        J = model.jacobian(q)
-        Ja = J[:, 1:]
-        m2 = np.linalg.det(Ja @ Ja.T)
-        return -m2
-
+def worst_case_v(J):
+    ''' Unit EE velocity direction v that maximizes v.T @ inv(J @ J.T) @ v,
+        i.e. the direction that is hardest to move in: the eigenvector of
+        J @ J.T with the smallest eigenvalue. '''
+    eigs, vecs = np.linalg.eigh(J @ J.T)
+    return vecs[:, 0], 1 / eigs[0]
 
-    def worst_case_v(J):
-        W = np.linalg.inv(J.dot(J.T))
-        max_val = 0
-        opt_v = np.zeros(2)
-        for i in range(1000):
-            v = np.random.rand(2)
-            v = v / np.linalg.norm(v)
-            C = v.T @ W @ v
-
-            if C > max_val:
-                max_val = C
-                opt_v = v
-        return opt_v, max_val
 
+def main():
+    model = ThreeInputModel(l1=L1, l2=L2, vel_lim=UB, output_idx=[0, 1])
 
-    # qa0 = np.zeros(2)
-    # res = opt.minimize(manipulability, qa0, method='Nelder-Mead')
+    # manipulability of the arm alone over its whole joint space
+    mmap = manipulability.load_map(model, arm_only=True)
+    i1, i2 = np.unravel_index(np.argmax(mmap.manipulability),
+                              mmap.manipulability.shape)
+    print('max arm manipulability {:.3f} at θ1 = {:.3f}, θ2 = {:.3f}'.format(
+        mmap.manipulability[i1, i2], mmap.angles[i1], mmap.angles[i2]))
 
     # optimal solution is q2 = +-pi/2
     q = np.array([0, 0, np.pi/2])
     J = model.jacobian(q)
 
     opt_v, max_val = worst_case_v(J)
-
-    IPython.embed()
+    print('worst-case direction {} (v.T @ inv(J @ J.T) @ v = {:.3f})'.format(
+        opt_v, max_val))
 
 
 if __name__ == '__main__':
@@ -8,6 +8,13 @@ import IPython
 from mm2d import models
 
 
+# body points sampled for collision checking: more points give a more
+# accurate obstacle cost at a higher computational cost
+LINK_SAMPLES = 1
+BASE_SAMPLES = 3
+
+OBS_EPS = 0.1  # distance from obstacles at which cost becomes non-zero
+
 # optimize over q1...qn, with q0 and qn+1 the fixed end points
 
 
@@ -17,27 +24,20 @@ class CircleField:
         self.r = r
 
     def signed_dist(self, x):
-        return np.linalg.norm(x - self.c) - self.r
+        return np.linalg.norm(x - self.c, axis=-1) - self.r
 
     def signed_dist_grad(self, x):
-        return (x - self.c) / np.linalg.norm(x - self.c)
+        return (x - self.c) / np.linalg.norm(x - self.c, axis=-1)[..., None]
 
     def cost(self, x, eps):
         d = self.signed_dist(x)
-        if d <= 0:
-            return -d + 0.5 * eps
-        elif d <= eps:
-            return (d-eps)**2 / (2*eps)
-        return 0
+        return np.where(d <= 0, -d + 0.5 * eps,
+                        np.where(d <= eps, (d-eps)**2 / (2*eps), 0))
 
     def cost_grad(self, x, eps):
-        d = self.signed_dist(x)
+        d = self.signed_dist(x)[..., None]
         dg = self.signed_dist_grad(x)
-        if d <= 0:
-            return -dg
-        elif d <= eps:
-            return -(d - eps) * dg / eps
-        return np.zeros(dg.shape)
+        return np.where(d <= 0, -dg, np.where(d <= eps, -(d - eps) * dg / eps, 0))
 
 
 class FloorField:
@@ -45,23 +45,21 @@ class FloorField:
         self.y = y
 
     def signed_dist(self, p):
-        return p[1] - self.y
+        return p[..., 1] - self.y
 
     def signed_dist_grad(self, p):
-        return np.sign([0, p[1]])
+        dg = np.zeros_like(p)
+        dg[..., 1] = np.sign(p[..., 1])
+        return dg
 
     def cost(self, p, eps):
         d = self.signed_dist(p)
-        if d <= 0:
-            return d**2
-        return 0
+        return np.where(d <= 0, d**2, 0)
 
     def cost_grad(self, x, eps):
-        d = self.signed_dist(x)
+        d = self.signed_dist(x)[..., None]
         dg = self.signed_dist_grad(x)
-        if d <= 0:
-            return 2*d*dg
-        return np.zeros(dg.shape)
+        return np.where(d <= 0, 2*d*dg, 0)
 
 
 class ObstacleField:
@@ -69,7 +67,7 @@ class ObstacleField:
         self.obstacles = obstacles
 
     def cost(self, p, eps):
-        cost = np.sum([obs.cost(p, eps) for obs in self.obstacles])
+        cost = np.sum([obs.cost(p, eps) for obs in self.obstacles], axis=0)
         return cost
 
     def cost_grad(self, p, eps):
@@ -133,48 +131,9 @@ def motion_grad(model, traj, q0, qf, N):
     return grad
 
 
-def obs_grad_one_step(model, q, dq, ddq, field):
-    ''' Compute the obstacle gradient for a single waypoint. '''
-    n = q.shape[0]
-    Js = model.sample_jacobians(q)
-    dJs = model.sample_dJdt(q, dq)
-
-    # Cartesian position, velocity, acceleration
-    xs = model.sample_points(q)
-    dxs = Js @ dq
-    ddxs = Js @ ddq + dJs @ dq
-
-    grad = np.zeros(n)
-    eps = 1e-8
-
-    num_pts = xs.shape[0]
-
-    # numerical integration over the 5 points on the body
-    for i in range(num_pts):
-        x = xs[i, :]
-        dx = dxs[i, :]
-        ddx = ddxs[i, :]
-        J = Js[i, :, :]
-
-        obs_eps = 0.1
-        c = field.cost(x, obs_eps)
-        dc = field.cost_grad(x, obs_eps)
-
-        dx_norm = np.linalg.norm(dx)
-        if dx_norm < eps:
-            continue
-
-        dx_unit = dx / dx_norm
-        A = np.eye(2) - np.outer(dx_unit, dx_unit)
-        kappa = A @ ddx / dx_norm**2
-
-        grad += dx_norm * J.T @ (A @ dc - c * kappa)
-
-    return grad / num_pts
-
-
 def obs_grad(model, traj, q0, qf, field, N):
-    ''' Compute the obstacle gradient for the entire trajectory. '''
+    ''' Compute the obstacle gradient for the entire trajectory. All
+        waypoints and all points sampled on the body are evaluated at once. '''
     n = q0.shape[0]
 
     # finite diff matrices
@@ -182,28 +141,46 @@ def obs_grad(model, traj, q0, qf, field, N):
     Ka, ea = fd2(N, n, q0, qf)
 
     # first and second derivatives of the trajectory
-    dtraj = Kv @ traj + ev
-    ddtraj = Ka @ traj + ea
+    qs = traj.reshape((N, n))
+    dqs = (Kv @ traj + ev)[:N*n].reshape((N, n))
+    ddqs = (Ka @ traj + ea).reshape((N, n))
 
-    grad = np.zeros(N * n)
+    Js = model.sample_jacobians_batch(qs)
+    dJs = model.sample_dJdt_batch(qs, dqs)
 
-    for i in range(N):
-        l = i*n
-        u = (i+1)*n
+    # Cartesian position, velocity, acceleration of each body point at each
+    # waypoint
+    xs = model.sample_points_batch(qs)
+    dxs = np.einsum('kpij,kj->kpi', Js, dqs)
+    ddxs = np.einsum('kpij,kj->kpi', Js, ddqs) + np.einsum('kpij,kj->kpi', dJs, dqs)
 
-        q = traj[l:u]
-        dq = dtraj[l:u]
-        ddq = ddtraj[l:u]
+    c = field.cost(xs, OBS_EPS)[..., None]
+    dc = field.cost_grad(xs, OBS_EPS)
 
-        grad[l:u] += obs_grad_one_step(model, q, dq, ddq, field)
+    # points that are not moving do not contribute
+    dx_norm = np.linalg.norm(dxs, axis=-1)[..., None]
+    moving = dx_norm >= 1e-8
+    dx_norm = np.where(moving, dx_norm, 1)
+    dx_unit = dxs / dx_norm
 
-    return grad
+    # A = I - dx_unit @ dx_unit.T projects orthogonally to the velocity
+    A_dc = dc - dx_unit * np.sum(dx_unit * dc, axis=-1, keepdims=True)
+    A_ddx = ddxs - dx_unit * np.sum(dx_unit * ddxs, axis=-1, keepdims=True)
+    kappa = A_ddx / dx_norm**2
+
+    # numerical integration over the points on the body
+    g = np.einsum('kpij,kpi->kpj', Js, moving * dx_norm * (A_dc - c * kappa))
+    grad = np.mean(g, axis=1)
+
+    return grad.flatten()
 
 
 def main():
     np.set_printoptions(precision=3, suppress=True)
 
-    model = models.ThreeInputModel(output_idx=[0, 1])
+    model = models.ThreeInputModel(output_idx=[0, 1],
+                                   link_samples=LINK_SAMPLES,
+                                   base_samples=BASE_SAMPLES)
 
     circle = CircleField([3, 1], 0.5)
     floor = FloorField(0)
@@ -214,7 +191,13 @@ def main():
 
     q0 = np.array([0, np.pi/4.0, -np.pi/4.0])
     qf = np.array([5, np.pi/4.0, -np.pi/4.0])
-    traj0 = np.linspace(q0, qf, N + 2)[1:-1, :].flatten()
+
+    # initial trajectory follows a straight line in task space, with the base
+    # interpolated between the end points
+    P = np.linspace(model.forward(q0), model.forward(qf), N + 2)[1:-1, :]
+    q_nominal = np.linspace(q0, qf, N + 2)[1:-1, :]
+    traj0, _ = model.inverse_kinematics(P, q_nominal=q_nominal)
+    traj0 = traj0.flatten()
     traj = traj0
 
     Kv, ev = fd1(N, n, q0, qf)
@@ -232,7 +215,7 @@ def main():
 
     traj = np.concatenate((q0, traj, qf)).reshape((N + 2, n))
 
-    points = np.array([model.sample_points(traj[i, :])[2:, :] for i in range(N + 1)])
+    points = model.arm_points_batch(traj)
 
     ax = plt.gca()
     ax.set_aspect('equal')
@@ -1,34 +1,37 @@
+import sys
+
 import numpy as np
 import pymunk
-import pymunk.matplotlib_util
-import matplotlib.pyplot as plt
 
-from mm2d.simulations import PymunkSimulationVelocity, PymunkSimulationTorque
+from mm2d.simulations import (PymunkSimulationVelocity, PymunkSimulationTorque,
+                              run_headless)
 from mm2d import models, control, plotter
 from mm2d import trajectory as trajectories
 from mm2d.util import rms
 
-import IPython
-
 
 # sim parameters
-DT = 0.001         # simulation timestep (s)
+DT = 0.001         # physics timestep (s)
 PLOT_PERIOD = 100  # update plot every PLOT_PERIOD timesteps
 CTRL_PERIOD = 100  # generate new control signal every CTRL_PERIOD timesteps
 
+# the sim runs CTRL_PERIOD physics substeps per call to step
+CTRL_DT = DT * CTRL_PERIOD
+PLOT_TICKS = PLOT_PERIOD // CTRL_PERIOD
+
 DURATION = 10.0  # duration of trajectory (s)
 
 
 def main():
-    N = int(DURATION / DT) + 1
+    N = int(DURATION / CTRL_DT) + 1
 
     model = models.ThreeInputModel(output_idx=[0, 1])
 
-    ts = DT * np.arange(N)
+    ts = CTRL_DT * np.arange(N)
     q0 = np.array([0, np.pi/4.0, -np.pi/4.0])
     p0 = model.forward(q0)
 
-    sim = PymunkSimulationTorque(DT, iterations=10)
+    sim = PymunkSimulationTorque(CTRL_DT, iterations=10, substeps=CTRL_PERIOD)
     sim.add_robot(model, q0)
 
     box_body = pymunk.Body()
@@ -49,6 +52,44 @@ def main():
 
     ps = np.zeros((N, model.no))
     pds = np.zeros((N, model.no))
+    ps[0, :] = p0
+    pds[0, :] = trajectory.sample(0, flatten=True)[0][:model.no]
+
+    kp = 0
+    kd = 10
+    ddqd = np.zeros(3)
+    qd = q0
+
+    def policy(i, q, dq):
+        # controller
+        pd, vd, ad = trajectory.sample(ts[i], flatten=True)
+        u = controller.solve(q, dq, pd, vd)
+        # sim.command_velocity(u)
+
+        # torque control law
+        α = ddqd + kp * (qd - q) + kd * (u - dq)
+        tau = model.calc_torque(q, dq, α)
+        sim.command_torque(tau)
+        pds[i+1, :] = pd[:model.no]
+
+    if '--headless' in sys.argv:
+        # no plotting: run as fast as possible and report the throughput
+        qs, _, report = run_headless(sim, policy, N - 1)
+        ps[1:, :] = model.forward_batch(qs[1:])
+        print(report)
+    else:
+        run_with_plot(sim, model, policy, trajectory, ts, box, box_corners,
+                      ps, q0)
+
+    xe = pds[1:, 0] - ps[1:, 0]
+    ye = pds[1:, 1] - ps[1:, 1]
+    print('RMSE(x) = {}'.format(rms(xe)))
+    print('RMSE(y) = {}'.format(rms(ye)))
+
+
+def run_with_plot(sim, model, policy, trajectory, ts, box, box_corners, ps, q0):
+    import matplotlib.pyplot as plt
+    import pymunk.matplotlib_util
 
     robot_renderer = plotter.ThreeInputRenderer(model, q0)
     box_renderer = plotter.PolygonRenderer(np.array(box.body.position),
@@ -73,42 +114,15 @@ def main():
     options = pymunk.matplotlib_util.DrawOptions(ax)
     options.flags = pymunk.SpaceDebugDrawOptions.DRAW_SHAPES
 
-    q = q0
-    dq = np.zeros(3)
-    u = np.zeros(3)
-    pd, vd, ad = trajectory.sample(0, flatten=True)
-
-    ps[0, :] = p0
-    pds[0, :] = pd[:model.no]
-
-    kp = 0
-    kd = 10
-    ddqd = np.zeros(3)
-    dqd = np.zeros(3)
-    qd = q0
-
-    for i in range(N - 1):
-        t = ts[i]
+    q, dq = sim.q, sim.dq
+    for i in range(len(ts) - 1):
+        policy(i, q, dq)
 
-        # controller
-        if i % CTRL_PERIOD == 0:
-            pd, vd, ad = trajectory.sample(t, flatten=True)
-            u = controller.solve(q, dq, pd, vd)
-            # sim.command_velocity(u)
-
-            # torque control law
-            α = ddqd + kp * (qd - q) + kd * (u - dq)
-            tau = model.calc_torque(q, dq, α)
-            sim.command_torque(tau)
-
-        # step the sim
+        # step the sim through one control period
         q, dq = sim.step()
+        ps[i+1, :] = model.forward(q)
 
-        p = model.forward(q)
-        ps[i+1, :] = p
-        pds[i+1, :] = pd[:model.no]
-
-        if i % PLOT_PERIOD == 0:
+        if i % PLOT_TICKS == 0:
             box_renderer.set_state(np.array(box.body.position), box.body.angle)
             robot_renderer.set_state(q)
 
@@ -123,11 +137,6 @@ def main():
             plot.update()
     plot.done()
 
-    xe = pds[1:, 0] - ps[1:, 0]
-    ye = pds[1:, 1] - ps[1:, 1]
-    print('RMSE(x) = {}'.format(rms(xe)))
-    print('RMSE(y) = {}'.format(rms(ye)))
-
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,51 @@
+"""Check that resetting a pymunk simulation gives the same episode as a newly
+built one, i.e. that no solver state is carried over from earlier episodes."""
+import numpy as np
+
+from mm2d.simulations import PymunkSimulationVelocity, PymunkSimulationTorque
+from mm2d import models
+
+
+DT = 0.01        # control period (s)
+NUM_STEPS = 100  # length of each compared episode
+TOLERANCE = 1e-9
+
+
+def run(sim, inputs):
+    command = sim.command_torque if isinstance(sim, PymunkSimulationTorque) \
+            else sim.command_velocity
+    qs = np.zeros((len(inputs), 3))
+    for k, u in enumerate(inputs):
+        command(u)
+        qs[k], _ = sim.step()
+    return qs
+
+
+def main():
+    model = models.ThreeInputModel(output_idx=[0, 1])
+    q0 = np.array([0, np.pi/4.0, -np.pi/4.0])
+    rng = np.random.default_rng(0)
+
+    for Sim, scale in ((PymunkSimulationTorque, 5.0),
+                       (PymunkSimulationVelocity, 0.5)):
+        inputs = scale * rng.normal(size=(NUM_STEPS, 3))
+
+        fresh = Sim(DT)
+        fresh.add_robot(model, q0)
+        qs_fresh = run(fresh, inputs)
+
+        # episodes of different lengths before the reset leave different
+        # contact and constraint impulses behind
+        for num_before in (1, 10, 50):
+            sim = Sim(DT)
+            sim.add_robot(model, q0)
+            run(sim, scale * rng.normal(size=(num_before, 3)))
+            sim.reset(q0)
+            error = np.max(np.abs(run(sim, inputs) - qs_fresh))
+            print('{}, reset after {} steps: max error {:.3g}'.format(
+                Sim.__name__, num_before, error))
+            assert error < TOLERANCE
+
+
+if __name__ == '__main__':
+    main()